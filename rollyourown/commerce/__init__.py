@@ -7,7 +7,15 @@
 
 """
 __authors__ = ["Will Hardy <rollyourown@willhardy.com.au>"]
-__all__ = ( 'Summary', 'Extra', 'Items', 'Total', 'json_summary')
+__all__ = ( 'Summary', 'Extra', 'Items', 'Total', 'json_summary',
+            'stream_json_summaries', 'Tracer', 'ExchangeRates',
+            'FileExchangeRates', 'ModelExchangeRates', 'Rounding', 'Tax',
+            'Promotions')
 
 from summary import Summary, Extra, Items, Total
-from utils import json_summary
+from utils import json_summary, stream_json_summaries
+from tracing import Tracer
+from currency import ExchangeRates, FileExchangeRates, ModelExchangeRates
+from rounding import Rounding
+from tax import Tax
+from promotions import Promotions
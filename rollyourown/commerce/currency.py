@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Exchange rate tables.
+
+    When the items of a summary are priced in different currencies (eg a
+    marketplace cart with sellers in several countries), the summary can
+    convert them to its own currency using an exchange rate table:
+
+        class CartSummary(commerce.Summary):
+            items = commerce.Items(currency="model.currency")
+            total = commerce.Total()
+
+            class Meta:
+                currency = "EUR"
+                exchange_rates = FileExchangeRates("/var/rates.json", ttl=3600)
+
+    The table is loaded once and reused by every summary until it is older
+    than its ttl (in seconds). Rates are given against any common base
+    currency, and a whole column of amounts is converted at once, with one
+    conversion factor for each currency. Each converted amount is quantized
+    to the currency's minor unit, so totals (which are sums of the converted
+    amounts) are the same no matter where they are calculated.
+
+"""
+import os
+from time import time
+from decimal import Decimal, Context, ROUND_HALF_EVEN
+from django.utils import simplejson
+
+# Enough precision for any realistic amount and rate
+CONVERSION_CONTEXT = Context(prec=28, rounding=ROUND_HALF_EVEN)
+
+
+class ExchangeRateError(Exception):
+    " Raised when an amount cannot be converted. "
+
+
+class ExchangeRates(object):
+    """ A table of exchange rates, mapping currency codes to the value of
+        one unit of a base currency. A static table can be given directly,
+        subclasses load the table from somewhere else by overriding load().
+    """
+    def __init__(self, rates=None, ttl=None, places=2, rounding=ROUND_HALF_EVEN):
+        self.ttl = ttl
+        self.exponent = Decimal(1).scaleb(-places)
+        self.rounding = rounding
+        self._rates = None
+        self._loaded = None
+        if rates is not None:
+            self._rates = self.parse_rates(rates)
+            self._loaded = time()
+
+    def load(self):
+        " Returns a dict of currency codes and rates. "
+        raise ExchangeRateError("No exchange rates have been given.")
+
+    def parse_rates(self, rates):
+        return dict((code, Decimal(str(rate))) for code, rate in dict(rates).items())
+
+    def expired(self):
+        return (self._rates is None or self.ttl is not None
+                                    and time() - self._loaded > self.ttl)
+
+    def get_rates(self):
+        " Returns the table, reloading it if it is older than the ttl. "
+        if self.expired():
+            self._rates = self.parse_rates(self.load())
+            self._loaded = time()
+        return self._rates
+
+    def get_factor(self, from_currency, to_currency):
+        " Returns the number that amounts in from_currency are multiplied by. "
+        if from_currency == to_currency:
+            return Decimal(1)
+        rates = self.get_rates()
+        try:
+            return CONVERSION_CONTEXT.divide(rates[to_currency], rates[from_currency])
+        except KeyError, e:
+            raise ExchangeRateError("No exchange rate for %s" % e.args[0])
+
+    def convert(self, amount, from_currency, to_currency):
+        return self.convert_column([amount], [from_currency], to_currency)[0]
+
+    def convert_column(self, amounts, currencies, to_currency):
+        """ Converts a list of amounts, each in the corresponding currency,
+            to the given currency. Amounts already in the right currency
+            are left as they are.
+        """
+        factors = {}
+        converted = []
+        for amount, currency in zip(amounts, currencies):
+            if currency == to_currency or currency is None:
+                converted.append(amount)
+                continue
+            if currency not in factors:
+                factors[currency] = self.get_factor(currency, to_currency)
+            if not isinstance(amount, Decimal):
+                amount = Decimal(str(amount or 0))
+            amount = CONVERSION_CONTEXT.multiply(amount, factors[currency])
+            converted.append(amount.quantize(self.exponent, rounding=self.rounding))
+        return converted
+
+
+class FileExchangeRates(ExchangeRates):
+    """ Loads the rates from a local file, either a JSON object of codes and
+        rates (if the filename ends in .json), or lines of "CODE,RATE".
+    """
+    def __init__(self, path, **kwargs):
+        self.path = path
+        super(FileExchangeRates, self).__init__(**kwargs)
+
+    def load(self):
+        f = open(self.path)
+        try:
+            if os.path.splitext(self.path)[1] == ".json":
+                return simplejson.load(f, parse_float=Decimal)
+            rates = {}
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    code, rate = line.split(",")
+                    rates[code.strip()] = rate.strip()
+            return rates
+        finally:
+            f.close()
+
+
+class ModelExchangeRates(ExchangeRates):
+    """ Loads the rates from a database table, with one row per currency.
+        A model or a queryset can be given.
+    """
+    def __init__(self, model, currency_field="currency", rate_field="rate", **kwargs):
+        self.model = model
+        self.currency_field = currency_field
+        self.rate_field = rate_field
+        super(ModelExchangeRates, self).__init__(**kwargs)
+
+    def load(self):
+        queryset = getattr(self.model, '_default_manager', self.model)
+        return queryset.values_list(self.currency_field, self.rate_field)
@@ -2,14 +2,17 @@
 # -*- coding: UTF-8 -*-
 
 from django import forms
-from django.forms.models import inlineformset_factory, modelformset_factory, formset_factory, ModelForm
-from django.forms.formsets import BaseFormSet
+from django.forms.models import inlineformset_factory, modelformset_factory, formset_factory, ModelForm, BaseModelForm
+from django.forms.formsets import BaseFormSet, DELETION_FIELD_NAME
 
 from django.utils.html import conditional_escape
 from django.utils.encoding import force_unicode
 from django.forms.forms import DeclarativeFieldsMetaclass, BoundField
 from django.utils.safestring import mark_safe
+from django.utils.datastructures import SortedDict
 from django.forms.models import _get_foreign_key
+from django.db import transaction
+from django.db.models import FileField
 
 class SummaryFormBase(object):
     """ A collection of formsets and form fields. 
@@ -21,6 +24,9 @@ class SummaryFormBase(object):
 
     def __init__(self, *args, **kwargs):
         self.instance = kwargs.pop('instance', None)
+        # Stop validating at the first invalid form or formset (eg for APIs)
+        self.fail_fast = kwargs.pop('fail_fast', False)
+        self._errors = None
         self.model_instance = self.instance.instance
         if self.instance is None:
             raise TypeError("%s requires an 'instance' argument" % self.__class__)
@@ -45,35 +51,100 @@ class SummaryFormBase(object):
                 queryset = getattr(self.instance, key)
                 self._formsets[key] = element(prefix=_prefix, queryset=queryset, *args, **kwargs)
 
-    def save(self, commit=True):
+    def save(self, commit=True, bulk=False):
+        """ Saves the summary model form, each sub-form and each formset.
+            If bulk is True, everything is saved in a single transaction, 
+            only changed formset rows are written and totals cached on
+            the model instance (see Total's model_cache) are recalculated 
+            once, at the end.
+        """
+        if bulk and commit:
+            return self._save_bulk()
         self._summary_form.save(commit)
         for form in self._forms.values():
             form.save(commit)
         for formset in self._formsets.values():
             formset.save(commit)
 
+    @transaction.commit_on_success
+    def _save_bulk(self):
+        """ Saves all forms and formsets in a single transaction. The forms
+            share the model instance, which is saved after the cached totals
+            are updated. Model forms are saved with commit=False, so that
+            the instance is only written once; other forms are saved as
+            usual, as they may not take the commit argument.
+        """
+        model_instance = self._summary_form.save(commit=False)
+        model_forms = [f for f in self._forms.values() if isinstance(f, BaseModelForm)]
+        for form in self._forms.values():
+            if form in model_forms:
+                form.save(commit=False)
+            else:
+                form.save()
+        for formset in self._formsets.values():
+            save_formset_bulk(formset)
+
+        # The items have changed, so the summary needs to fetch them again
+        # before any cached totals are recalculated.
+        self.instance._cache.clear()
+        for name, total in self.instance._meta.totals.items():
+            if total.model_cache is not None:
+                getattr(self.instance, name)
+
+        model_instance.save()
+        self._summary_form.save_m2m()
+        for form in model_forms:
+            form.save_m2m()
+        return model_instance
+
     def is_valid(self):
-        return (self._summary_form.is_valid() 
-                    and all([f.is_valid() for f in self._forms.values()]) 
-                    and all([f.is_valid() for f in self._formsets.values()]))
+        return self.is_bound and not self.errors
 
+    @property
     def is_bound(self):
-        return self._args or self._kwargs.get('data', False) or self._kwargs.get('files', False)
+        return self._summary_form.is_bound
+
+    def full_clean(self):
+        """ Validates the summary form, then each sub-form and formset in the
+            order they appear in the summary. Errors from the summary form 
+            are kept at the top level, all others are namespaced by the 
+            name of their element (formset errors by the prefix of each row).
+        """
+        errors = dict(self._summary_form.errors)
+        if not (self.fail_fast and errors):
+            for name in self.elements:
+                if name in self._forms and self._forms[name].errors:
+                    errors[name] = SummaryErrorDict(self._forms[name].errors)
+                elif name in self._formsets:
+                    formset = self._formsets[name]
+                    formset_errors = dict((f.prefix, f.errors) 
+                                            for f in formset.forms if f.errors)
+                    if formset.non_form_errors():
+                        formset_errors[NON_FIELD_ERRORS] = formset.non_form_errors()
+                    if formset_errors:
+                        errors[name] = SummaryErrorDict(formset_errors)
+                if self.fail_fast and name in errors:
+                    break
+        self._errors = SummaryErrorDict(errors)
 
     def non_form_errors(self):
-        # TODO
-        pass
+        """ Returns the errors that aren't associated with a particular 
+            field, from the summary form and each formset.
+        """
+        errors = ErrorList(self._summary_form.non_field_errors())
+        for name in self.elements:
+            if name in self.errors and NON_FIELD_ERRORS in self.errors[name]:
+                errors.extend(self.errors[name][NON_FIELD_ERRORS])
+        return errors
 
     @property
     def errors(self):
-        # TODO: key conflicts?
-        errors = self._summary_form.errors
-        for f in self._forms.values():
-            errors.update(f.errors)
-        for fs in self._formsets.values():
-            for f in fs.forms:
-                errors.update(f.errors)
-        return errors
+        """ Returns an (immutable) SummaryErrorDict of all errors, validating
+            the forms the first time it is accessed.
+        """
+        if self._errors is None:
+            self.full_clean()
+        return self._errors
 
     def table_data(self):
         """ Provides the data without the table tags, allowing for customised display. """
@@ -161,13 +232,6 @@ class SummaryFormBase(object):
             else:
                 output.append(u'<tr><th colspan="%d">%s</th><td>%s</td></tr>' % (self._max_form_columns+1, name, element))
 
-        # XXX TMP AUTO TEST CODE
-        f = open("/home/kogan/tmp/deletemenow.html", 'w')
-        f.write('<table>')
-        f.write(mark_safe("\n".join(output)))
-        f.write('</table>')
-        f.close()
-
         return mark_safe("\n".join(output))
 
     def as_ul(self):
@@ -294,6 +358,19 @@ class ReadOnlyField(forms.Field):
         return self.widget.initial 
 
 from django.forms.models import BaseModelFormSet
+from django.forms.forms import NON_FIELD_ERRORS
+from django.forms.util import ErrorDict, ErrorList
+
+class SummaryErrorDict(ErrorDict):
+    """ An ErrorDict which cannot be changed once it has been created, so
+        that the cached errors of a summary form can be shared safely.
+    """
+    def complain(self, *args, **kwargs):
+        raise AttributeError("SummaryErrorDict object is immutable.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = complain
+    setdefault = update = complain
+
 
 class SummaryFormSet(BaseModelFormSet):
     def get_queryset(self):
@@ -316,6 +393,56 @@ class SummaryFormSet(BaseModelFormSet):
         return self._queryset
 
 
+def save_formset_bulk(formset):
+    """ Saves the changed rows of a (valid) model formset, using as few 
+        queries as possible. Existing rows only have their changed columns
+        updated, rows with identical changes are updated together, deleted
+        rows are removed in one query and new rows are inserted with 
+        bulk_create() where Django provides it.
+        NB: Like QuerySet.update(), this skips the save() method and the
+        pre_save/post_save signals for existing rows, except for rows with
+        changed files, which need saving to their storage.
+    """
+    manager = formset.model._default_manager
+    concrete_fields = dict((f.name, f) for f in formset.model._meta.fields
+                                if not isinstance(f, FileField))
+    updates = SortedDict()
+    deleted_pks = []
+    new_instances = []
+
+    for form in formset.initial_forms:
+        obj = form.instance
+        if formset.can_delete and form.cleaned_data.get(DELETION_FIELD_NAME):
+            deleted_pks.append(obj.pk)
+        elif not form.has_changed():
+            continue
+        elif [n for n in form.changed_data if n not in concrete_fields]:
+            # Many to many, file and other special fields need the full save()
+            formset.save_existing(form, obj)
+        else:
+            values = tuple((n, getattr(obj, n)) for n in form.changed_data)
+            try:
+                updates.setdefault(values, []).append(obj.pk)
+            except TypeError:
+                # Unhashable values cannot be grouped with other rows
+                manager.filter(pk=obj.pk).update(**dict(values))
+
+    for form in formset.extra_forms:
+        if form.has_changed() and not (formset.can_delete 
+                            and form.cleaned_data.get(DELETION_FIELD_NAME)):
+            new_instances.append(form.save(commit=False))
+
+    for values, pks in updates.items():
+        manager.filter(pk__in=pks).update(**dict(values))
+    if deleted_pks:
+        manager.filter(pk__in=deleted_pks).delete()
+    if hasattr(manager, 'bulk_create'):
+        manager.bulk_create(new_instances)
+    else:
+        for obj in new_instances:
+            obj.save()
+
+
 def subform_factory(summary, items, included_fields=None):
     # TODO: fk_name may be necessary
     excludes = []
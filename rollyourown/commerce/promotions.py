@@ -0,0 +1,280 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Promotions element.
+
+    A Promotions element is an Extra whose (negative) amount is the discount
+    given by a set of promotion rules:
+
+        class CartSummary(commerce.Summary):
+            items      = commerce.Items()
+            promotions = commerce.Promotions(rules="self.get_promotions",
+                                             category_from="model.category_id")
+            total      = commerce.Total()
+
+            def get_promotions(self, instance):
+                return PROMOTIONS
+
+        PROMOTIONS = PromotionIndex([
+            PercentOff(10, categories=[BOOKS], cap=20, name="10% off books"),
+            BuyXGetY(2, 1, products=[SOCKS], name="3 for 2 on socks"),
+            TieredPercentOff([(5, 5), (10, 10)], name="Bulk discount"),
+            ])
+
+    The rules are compiled into an index by product and by category, so
+    the items are looked at once, however many rules there are, and only
+    the rules that match an item do any work. Each rule then calculates its
+    discount from the lines it matched. The rules that applied are
+    reported:
+
+        >>> summary.promotions.applied
+        [(<PercentOff: 10% off books>, Decimal('4.50'))]
+
+"""
+from decimal import Decimal
+from rollyourown.commerce.summary import Extra, BoundExtra, NotSet, get_item_values
+from rollyourown.commerce.rounding import Rounding, to_decimal
+
+
+#
+# Rules
+#
+# A rule applies to the items with any of the given products or categories,
+# or to every item if neither are given. Each line an item matches is given
+# to the rule as (unit price, quantity, amount).
+#
+
+class Rule(object):
+    """ Parent class for promotion rules. The discount of a rule is never
+        more than its cap, if one is given.
+    """
+    def __init__(self, products=None, categories=None, cap=None, name=None):
+        self.products = products or ()
+        self.categories = categories or ()
+        if cap is not None:
+            cap = to_decimal(cap)
+        self.cap = cap
+        self.name = name or self.__class__.__name__
+
+    def __unicode__(self):
+        return self.name
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.name)
+
+    def get_discount(self, lines):
+        """ Returns the discount for the given lines, before the cap. Rules
+            override this, by default there is no discount.
+        """
+        return Decimal(0)
+
+    def discount(self, lines):
+        discount = self.get_discount(lines)
+        if self.cap is not None and discount > self.cap:
+            discount = self.cap
+        return discount
+
+
+class PercentOff(Rule):
+    " A percentage off every matching line. "
+    def __init__(self, percent, **kwargs):
+        self.percent = to_decimal(percent)
+        super(PercentOff, self).__init__(**kwargs)
+
+    def get_discount(self, lines):
+        return sum([line[2] for line in lines]) * self.percent / 100
+
+
+class TieredPercentOff(Rule):
+    """ A percentage off every matching line, depending on the quantity (or
+        amount) bought. Tiers are given as (minimum, percent).
+    """
+    def __init__(self, tiers, by_amount=False, **kwargs):
+        self.tiers = sorted([(to_decimal(m), to_decimal(p)) for m, p in tiers], reverse=True)
+        self.by_amount = by_amount
+        super(TieredPercentOff, self).__init__(**kwargs)
+
+    def get_discount(self, lines):
+        total = sum([line[2] for line in lines])
+        if self.by_amount:
+            measure = total
+        else:
+            measure = sum([line[1] for line in lines])
+        for minimum, percent in self.tiers:
+            if measure >= minimum:
+                return total * percent / 100
+        return Decimal(0)
+
+
+class BuyXGetY(Rule):
+    """ For every buy + get units of the matching items, the cheapest get
+        units are free.
+    """
+    def __init__(self, buy, get=1, **kwargs):
+        self.buy = buy
+        self.get = get
+        super(BuyXGetY, self).__init__(**kwargs)
+
+    def get_discount(self, lines):
+        units = sum([line[1] for line in lines])
+        # Only whole groups count (quantities can be Decimals)
+        free = units // (self.buy + self.get) * self.get
+        discount = Decimal(0)
+        for price, quantity, amount in sorted(lines):
+            if free <= 0:
+                break
+            discount += price * min(free, quantity)
+            free -= quantity
+        return discount
+
+
+class PromotionIndex(object):
+    """ A set of rules, indexed by product and by category. Create this once
+        for a set of rules and reuse it, a list of rules given to Promotions
+        is indexed for every summary.
+    """
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.by_product = {}
+        self.by_category = {}
+        self.general = []
+        for i, rule in enumerate(self.rules):
+            for product in rule.products:
+                self.by_product.setdefault(product, []).append(i)
+            for category in rule.categories:
+                self.by_category.setdefault(category, []).append(i)
+            if not rule.products and not rule.categories:
+                self.general.append(i)
+
+    def match(self, product, category=None):
+        " Returns the indexes of the rules matching the given item. "
+        matches = self.general + self.by_product.get(product, [])
+        if category is not None:
+            matches = matches + self.by_category.get(category, [])
+        return matches
+
+    def evaluate(self, lines):
+        """ Returns the rules that apply to the given lines and their
+            discounts, in the order of the rules. Lines are given as
+            (product, category, unit price, quantity, amount). Rules stack,
+            but the discounts given on a line never add up to more than its
+            amount: a rule's discount is limited to what is left of the
+            lines it matched.
+        """
+        matched = {}
+        for n, (product, category, price, quantity, amount) in enumerate(lines):
+            indexes = self.match(product, category)
+            # A rule can match by product and by category, count it once
+            if len(indexes) > 1:
+                indexes = set(indexes)
+            for i in indexes:
+                matched.setdefault(i, []).append(n)
+
+        remaining = [max(line[4], 0) for line in lines]
+        applied = []
+        for i in sorted(matched):
+            discount = self.rules[i].discount([lines[n][2:] for n in matched[i]])
+            discount = min(discount, sum([remaining[n] for n in matched[i]]))
+            if discount:
+                applied.append((self.rules[i], discount))
+                # Take the discount off the remaining amounts, line by line
+                left = discount
+                for n in matched[i]:
+                    taken = min(left, remaining[n])
+                    remaining[n] -= taken
+                    left -= taken
+        return applied
+
+
+#
+# Summary element
+#
+
+class Promotions(Extra):
+    """ Describes the discount given by a set of promotion rules.
+
+        rules          a PromotionIndex or a list of rules, or a reference
+                       to a method or callable providing one
+        product_from   how the product of each item is found ("model.XYZ",
+                       "self.XYZ" or a callable, as for Tax.rate_from)
+        category_from  how the category of each item is found, if any rules
+                       apply to categories
+        quantity_from  how the quantity of each item is found
+        items          the names of the Items elements, by default all
+    """
+
+    def __init__(self, verbose_name=NotSet, rules=NotSet,
+                        product_from="model.product_id", category_from=None,
+                        quantity_from="model.quantity", items=None,
+                        description=NotSet, rounding=None):
+        self.rules = rules
+        self.product_from = product_from
+        self.category_from = category_from
+        self.quantity_from = quantity_from
+        if isinstance(items, basestring):
+            items = (items,)
+        self.items = items
+        self.rounding = rounding
+        super(Promotions, self).__init__(verbose_name=verbose_name,
+                                                    description=description)
+
+    def contribute_to_class(self, cls, name):
+        if self.rules is NotSet:
+            self.rules = "self.get_%s_rules" % name
+        super(Promotions, self).contribute_to_class(cls, name)
+        # The amount is always calculated from the items
+        self.amount = None
+
+    def bound_extra(self, summary):
+        return BoundPromotions(summary, self)
+
+
+class BoundPromotions(BoundExtra):
+    """ Promotions bound to a summary instance. The rules are evaluated
+        once, the first time the amount is used.
+    """
+    def __init__(self, summary_instance, promotions):
+        super(BoundPromotions, self).__init__(summary_instance, promotions)
+        self._rules = self.get_referenced_method('rules')
+        self._applied = None
+
+    @property
+    def applied(self):
+        " The rules that applied and their discounts, as (rule, discount). "
+        if self._applied is None:
+            self._applied = self.resolve_value(self.evaluate)
+        return self._applied
+
+    @property
+    def amount(self):
+        discount = sum([discount for rule, discount in self.applied], Decimal(0))
+        return self._summary_instance._meta.amount_class(-discount,
+                                    summary_instance=self._summary_instance)
+
+    def evaluate(self, instance=None):
+        promotions = self._extra
+        summary = self._summary_instance
+        meta = summary._meta
+        index = self._resolve_value(self._rules)
+        if not isinstance(index, PromotionIndex):
+            index = PromotionIndex(index)
+        rounding = promotions.rounding or meta.rounding or Rounding()
+
+        lines = []
+        for name in promotions.items or meta.items.keys():
+            amount_attribute = meta.items[name].cache_amount_as
+            items = getattr(summary, name)
+            products = get_item_values(promotions.product_from, items, summary)
+            quantities = get_item_values(promotions.quantity_from, items, summary)
+            if promotions.category_from is not None:
+                categories = get_item_values(promotions.category_from, items, summary)
+            else:
+                categories = [None] * len(products)
+            for item, product, category, quantity in zip(items, products,
+                                                    categories, quantities):
+                amount = to_decimal(getattr(item, amount_attribute))
+                price = quantity and amount / quantity or amount
+                lines.append((product, category, price, quantity, amount))
+
+        return [(rule, rounding.quantize(discount, meta.currency))
+                            for rule, discount in index.evaluate(lines)]
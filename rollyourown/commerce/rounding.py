@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Rounding policies.
+
+    By default, totals are the exact sum of whatever amounts the items and
+    extras provide. A rounding policy can be given to the summary's Meta, or
+    to an individual Total, so that totals are rounded once, in the same way
+    every time:
+
+        class InvoiceSummary(commerce.Summary):
+            items = commerce.Items()
+            tax   = commerce.Extra()
+            total = commerce.Total()
+            items_total = commerce.Total('items', rounding=Rounding(per_line=True))
+
+            class Meta:
+                currency = "EUR"
+                rounding = Rounding(mode=ROUND_HALF_UP)
+
+    Either each line is rounded before it is added (per_line=True, which is
+    how many tax authorities expect invoices to add up), or only the total
+    is rounded. All the arithmetic is done with the policy's own decimal
+    context, so the thread's decimal context does not affect the result.
+
+"""
+from decimal import Decimal, Context, ROUND_HALF_UP
+from rollyourown.commerce.utils.money import Money, CURRENCY_PLACES, DEFAULT_PLACES
+
+
+class Rounding(object):
+    """ A rounding policy. If the number of decimal places isn't given, it is
+        taken from the currency (2 for most currencies).
+    """
+    def __init__(self, places=None, mode=ROUND_HALF_UP, per_line=False):
+        self.places = places
+        self.mode = mode
+        self.per_line = per_line
+        self.context = Context(prec=28, rounding=mode)
+        self._exponents = {}
+
+    def get_exponent(self, currency=None):
+        " Returns the exponent amounts are quantized to, eg Decimal('0.01'). "
+        if currency not in self._exponents:
+            places = self.places
+            if places is None:
+                places = CURRENCY_PLACES.get(currency, DEFAULT_PLACES)
+            self._exponents[currency] = Decimal(1).scaleb(-places)
+        return self._exponents[currency]
+
+    def quantize(self, value, currency=None):
+        return to_decimal(value).quantize(self.get_exponent(currency),
+                                                    context=self.context)
+
+    def total(self, column, currency=None):
+        """ Returns the rounded sum of the given amounts, in a single pass
+            over the column.
+        """
+        exponent = self.get_exponent(currency)
+        context = self.context
+        total = Decimal(0)
+        if self.per_line:
+            for value in column:
+                total = context.add(total,
+                        to_decimal(value).quantize(exponent, context=context))
+        else:
+            for value in column:
+                total = context.add(total, to_decimal(value))
+        return total.quantize(exponent, context=context)
+
+
+def to_decimal(value):
+    " Returns the given amount as a Decimal. "
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, Money):
+        return value.to_decimal()
+    if isinstance(value, float):
+        value = str(value)
+    return Decimal(value or 0)
@@ -18,9 +18,10 @@
 
 """
 from decimal import Decimal
-from rollyourown.commerce.utils import FormattedDecimal
+from rollyourown.commerce.utils import FormattedDecimal, Money
 from django.utils.datastructures import SortedDict
 from rollyourown.commerce.forms import generate_summary_form
+from rollyourown.commerce.currency import ExchangeRateError
 
 # Django models are not necessary, but receieve special attention (eg through=
 # arguments are honoured). The following imports to do affect the 
@@ -60,8 +61,10 @@ class ExtraDescriptor(object):
             raise AttributeError('Can only be accessed via an instance.')
 
         # Bind and add the Extra object
+        # (Its values are resolved each time they are used, so reusing it
+        # is not a cache hit)
         if self.extra.name not in obj.__dict__:
-            obj.__dict__[self.extra.name] = BoundExtra(obj, self.extra)
+            obj.__dict__[self.extra.name] = self.extra.bound_extra(obj)
         return obj.__dict__[self.extra.name]
 
     def __set__(self, obj, value):
@@ -101,7 +104,8 @@ class BoundExtra(object):
 
     @property
     def amount(self):
-        return FormattedDecimal(self.resolve_value(self._amount),
+        return self._summary_instance._meta.amount_class(
+                            self.resolve_value(self._amount),
                             summary_instance=self._summary_instance)
 
     def resolve_value(self, value):
@@ -110,6 +114,16 @@ class BoundExtra(object):
             all other callables are called with the model instance as
             the only argument.
         """
+        tracer = self._summary_instance._tracer
+        if tracer is None:
+            return self._resolve_value(value)
+        token = tracer.start('extra', self._extra.name)
+        try:
+            return self._resolve_value(value)
+        finally:
+            tracer.stop(token)
+
+    def _resolve_value(self, value):
         if callable(value):
             # Is this callable a method on our instance?
             if getattr(value, 'im_self', None) is self._instance:
@@ -198,6 +212,9 @@ class Extra(CommerceElement):
 
         setattr(cls, name, ExtraDescriptor(self))
 
+    def bound_extra(self, summary):
+        return BoundExtra(summary, self)
+
 
 #
 # Total objects
@@ -217,7 +234,19 @@ class TotalDescriptor(object):
     def __get__(self, obj, type=None):
         if obj is None:
             raise AttributeError('Can only be accessed via an instance.')
-        return self.total.get_total(obj)
+        # Totals computed for serialisation are kept in the summary's cache
+        key = ('total', self.total.name)
+        if key in obj._cache:
+            if obj._tracer is not None:
+                obj._tracer.cache_hit('total', self.total.name)
+            return obj._cache[key]
+        if obj._tracer is None:
+            return self.total.get_total(obj)
+        token = obj._tracer.start('total', self.total.name)
+        try:
+            return self.total.get_total(obj)
+        finally:
+            obj._tracer.stop(token)
 
     def __set__(self, obj, value):
         pass
@@ -231,6 +260,7 @@ class Total(CommerceElement):
         self.attributes = args
         self.prevent_negative = kwargs.pop('prevent_negative', False)
         self.model_cache = kwargs.pop('model_cache', None)
+        self.rounding = kwargs.pop('rounding', None)
         self.name = None
 
         if kwargs:
@@ -278,22 +308,22 @@ class Total(CommerceElement):
             extras = dict([(name,getattr(summary_instance, name))
                                     for name in summary_instance._meta.extras])
 
-        total = Decimal(0)
+        # Collect all the amounts to be summed
+        column = []
 
-        # Sum all the items
+        # Add all the items
         for name, qs in items.items():
             attribute_name = summary_instance._meta.items[name].cache_amount_as
-            item_total = sum([getattr(i, attribute_name) or 0 for i in qs])
-            total += item_total
+            column.extend([getattr(i, attribute_name) or 0 for i in qs])
 
-        # Sum all the extras
+        # Add all the extras
         for name,value in extras.items():
             if name not in negatives and not value.included:
-                total += value.amount or Decimal(0)
+                column.append(value.amount or Decimal(0))
             elif name in negatives and value.included:
-                total -= value.amount or Decimal(0)
+                column.append(-(value.amount or Decimal(0)))
 
-        # Sum any custom amounts
+        # Add any custom amounts
         for name,value in custom.items():
             if callable(value):
                 # If this is a method on our Summary instance
@@ -303,17 +333,31 @@ class Total(CommerceElement):
                     return value(summary_instance)
             if name in negatives:
                 value = -value
-            total += value or Decimal(0)
+            column.append(value or Decimal(0))
+
+        # Round the total (or each line) according to the rounding policy
+        rounding = self.rounding or summary_instance._meta.rounding
+        if rounding is not None:
+            total = rounding.total(column, summary_instance._meta.currency)
+        else:
+            total = sum(column, Decimal(0))
     
         if bool(self.prevent_negative) and total < 0:
             total = Decimal(0)
 
+        total = summary_instance._meta.amount_class(total, 
+                                        summary_instance=summary_instance)
+
         # Save the cached value to the database
         if self.model_cache is not None:
+            if isinstance(total, Money):
+                value = total.to_decimal()
+            else:
+                value = total
             summary_instance.save_total(summary_instance.instance, self.name,
-                                                self.model_cache, total)
+                                                self.model_cache, value)
 
-        return FormattedDecimal(total, summary_instance=summary_instance)
+        return total
 
 
 #
@@ -330,10 +374,12 @@ class Items(CommerceElement):
     """
 
     def __init__(self, attribute=NotSet, item_amount_from=NotSet, 
-                                    editable=None, cache_amount_as="AMOUNT"):
+                                    editable=None, cache_amount_as="AMOUNT",
+                                    currency=None):
         self.attribute = attribute
         self.item_amount_from = item_amount_from
         self.cache_amount_as = cache_amount_as
+        self.currency = currency
         self.name = None
         self.editable = editable
 
@@ -371,6 +417,7 @@ class BoundItems(object):
         self.attribute = self.items.attribute
         self.editable = self.items.editable
         self.cache_amount_as = self.items.cache_amount_as
+        self.currency = self.items.currency
         self.rel_model = None
         self.end_model = None
         self.queryset = None
@@ -411,6 +458,39 @@ class BoundItems(object):
         if self.queryset and self.rel_model is None:
             self.rel_model = self.queryset[0].__class__
 
+    def get_currencies(self):
+        """ Returns the currency of each item, in the same order as the
+            queryset. Like item_amount_from, the currency can reference the
+            summary ("self.XYZ", called with each item) or each item
+            ("model.XYZ"), otherwise it is the currency code of every item.
+        """
+        currency = self.currency
+        if callable(currency) or currency.startswith(("self.", "model.")):
+            return get_item_values(currency, self.queryset, self.summary)
+        return [currency] * len(self.queryset)
+
+
+def get_item_values(reference, items, summary_instance):
+    """ Returns a value for each of the given items. The reference can be
+        a method on the summary ("self.XYZ", called with each item), an
+        attribute or method of each item ("model.XYZ") or a callable, which
+        is called with each item.
+    """
+    if callable(reference):
+        return [reference(i) for i in items]
+    if reference.startswith("self."):
+        method = getattr(summary_instance, reference[5:])
+        return [method(i) for i in items]
+    if reference.startswith("model."):
+        reference = reference[6:]
+    values = []
+    for i in items:
+        value = getattr(i, reference)
+        if callable(value):
+            value = value()
+        values.append(value)
+    return values
+
 
 class ItemsDescriptor(object):
 
@@ -426,26 +506,63 @@ class ItemsDescriptor(object):
         # TODO: Even better, only generate the amounts when the queryset
         #       is accessed.
 
-        # XXX: can this be created earlier? Can it be stored?
-        bound_items = self.items.bound_items(obj)
-
         if obj is None:
             raise AttributeError('Can only be accessed via an instance.')
 
-        if bound_items.name not in obj._cache:
-
-            # Calculate the amounts now, they will most likely be required later
-            # TODO: Move this to when the QuerySet is first accessed. 
-            #       Do this by subclassing QuerySet and customising.
-            item_amount_from = bound_items.item_amount_from
-            for i in bound_items.queryset:
-                amount = self.get_item_unit_total(item_amount_from, i, obj)
-                setattr(i, bound_items.cache_amount_as, 
-                                FormattedDecimal(amount, summary_instance=obj))
-    
-            obj._cache[bound_items.name] = bound_items.queryset
+        name = self.items.name
+        tracer = obj._tracer
+        if name in obj._cache:
+            if tracer is not None:
+                tracer.cache_hit('items', name)
+            return obj._cache[name]
 
-        return obj._cache[bound_items.name]
+        if tracer is not None:
+            token = tracer.start('items', name)
+        bound_items = self.items.bound_items(obj)
+        if tracer is not None:
+            # Fetch the items now, so that the query is timed separately
+            len(bound_items.queryset)
+            tracer.stop(token)
+
+        # Calculate the amounts now, they will most likely be required later
+        # TODO: Move this to when the QuerySet is first accessed. 
+        #       Do this by subclassing QuerySet and customising.
+        item_amount_from = bound_items.item_amount_from
+        amounts = []
+        for i in bound_items.queryset:
+            if tracer is not None:
+                token = tracer.start('item_amount', name)
+            amounts.append(self.get_item_unit_total(item_amount_from, i, obj))
+            if tracer is not None:
+                tracer.stop(token)
+
+        # Convert items priced in other currencies, the whole column at once
+        if bound_items.currency is not None:
+            amounts = self.convert_amounts(amounts, bound_items, obj)
+
+        amount_class = obj._meta.amount_class
+        for i, amount in zip(bound_items.queryset, amounts):
+            setattr(i, bound_items.cache_amount_as, 
+                            amount_class(amount, summary_instance=obj))
+
+        obj._cache[name] = bound_items.queryset
+        return obj._cache[name]
+
+    def convert_amounts(self, amounts, bound_items, summary_instance):
+        """ Converts the amounts to the summary's currency, using the
+            exchange rate table given in Meta.exchange_rates.
+        """
+        currencies = bound_items.get_currencies()
+        to_currency = summary_instance._meta.currency
+        if [c for c in currencies if c != to_currency]:
+            exchange_rates = summary_instance._meta.exchange_rates
+            if exchange_rates is None:
+                raise ExchangeRateError("%s has items in other currencies, "
+                            "but no exchange_rates are given in its Meta." 
+                            % summary_instance.__class__.__name__)
+            amounts = exchange_rates.convert_column(amounts, currencies, 
+                                                            to_currency)
+        return amounts
 
     def get_item_unit_total(self, value, rel_instance, summary_instance):
         if isinstance(value, basestring):
@@ -467,6 +584,9 @@ class SummaryOptions(object):
         self.locale = getattr(meta_options, 'locale', None)
         self.currency = getattr(meta_options, 'currency', None)
         self.decimal_html = getattr(meta_options, 'decimal_html', None)
+        self.exchange_rates = getattr(meta_options, 'exchange_rates', None)
+        self.amount_class = getattr(meta_options, 'amount_class', FormattedDecimal)
+        self.rounding = getattr(meta_options, 'rounding', None)
 
         self.elements = SortedDict()
         self.items = SortedDict()
@@ -516,10 +636,12 @@ class SummaryBase(type):
 
 class Summary(object):
     __metaclass__ = SummaryBase
+    _tracer = None
 
-    def __init__(self, instance, locale=None):
+    def __init__(self, instance, locale=None, tracer=None):
         self.instance = instance
         self._cache = {}
+        self._tracer = tracer
         if locale:
             self._meta.locale = locale
         
@@ -0,0 +1,130 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Tax element.
+
+    A Tax is an Extra whose amount is calculated from the items of the
+    summary, using a rate for each line. The rates are looked up in a
+    mapping (eg of product ids or tax classes to rates), which is loaded
+    once, so no queries are made for each line:
+
+        class InvoiceSummary(commerce.Summary):
+            items     = commerce.Items()
+            gst       = commerce.Tax(rates="self.get_tax_rates",
+                                     rate_from="model.product_id",
+                                     included=True)
+            total     = commerce.Total()
+            total_net = commerce.Total('items', '-gst')
+
+            def get_tax_rates(self, instance):
+                return load_tax_rates(Product.objects.all())
+
+    The tax of each line is stored on the item (as TAX, by default) and the
+    amount of the Tax element is their sum. Like any Extra, a Tax can be
+    used in totals, so inclusive and exclusive totals are regular Total
+    elements.
+
+"""
+from rollyourown.commerce.summary import Extra, BoundExtra, NotSet, get_item_values
+from rollyourown.commerce.rounding import Rounding, to_decimal
+
+
+class Tax(Extra):
+    """ Describes a tax calculated for each line of one or more Items.
+
+        rates      a mapping of keys to rates (eg Decimal("0.1") for 10%),
+                   or a reference to a method or callable providing one
+        rate_from  how the key for each item is found, "model.XYZ" for an
+                   attribute of the item, "self.XYZ" for a method on the
+                   Summary (called with the item) or a callable
+        items      the names of the Items elements to tax, by default all
+        included   whether the tax is already included in the item amounts
+    """
+
+    def __init__(self, verbose_name=NotSet, rates=NotSet,
+                        rate_from="model.product_id", items=None,
+                        default_rate=None, included=False, description=NotSet,
+                        rounding=None, cache_tax_as="TAX"):
+        self.rates = rates
+        self.rate_from = rate_from
+        if isinstance(items, basestring):
+            items = (items,)
+        self.items = items
+        self.default_rate = default_rate
+        self.rounding = rounding
+        self.cache_tax_as = cache_tax_as
+        super(Tax, self).__init__(verbose_name=verbose_name, included=included,
+                                                    description=description)
+
+    def contribute_to_class(self, cls, name):
+        if self.rates is NotSet:
+            self.rates = "self.get_%s_rates" % name
+        super(Tax, self).contribute_to_class(cls, name)
+        # The amount is always calculated from the items
+        self.amount = None
+
+    def bound_extra(self, summary):
+        return BoundTax(summary, self)
+
+
+class BoundTax(BoundExtra):
+    """ A Tax bound to a summary instance. The tax is calculated once, the
+        first time the amount is used.
+    """
+    def __init__(self, summary_instance, tax):
+        super(BoundTax, self).__init__(summary_instance, tax)
+        self._rates = self.get_referenced_method('rates')
+        self._tax = None
+
+    @property
+    def amount(self):
+        if self._tax is None:
+            self._tax = self.resolve_value(self.calculate)
+        return self._summary_instance._meta.amount_class(self._tax,
+                                    summary_instance=self._summary_instance)
+
+    def calculate(self, instance=None):
+        """ Calculates the tax for each line in one pass over the items,
+            with the factor for each distinct rate worked out only once.
+        """
+        tax = self._extra
+        summary = self._summary_instance
+        meta = summary._meta
+        rates = self._resolve_value(self._rates)
+        rounding = tax.rounding or meta.rounding or Rounding(per_line=True)
+        included = self.included
+
+        factors = {}
+        column = []
+        for name in tax.items or meta.items.keys():
+            amount_attribute = meta.items[name].cache_amount_as
+            items = getattr(summary, name)
+            keys = get_item_values(tax.rate_from, items, summary)
+            for item, key in zip(items, keys):
+                rate = rates.get(key, tax.default_rate)
+                if rate is None:
+                    raise KeyError("No tax rate for %r (%s)" % (key, tax.name))
+                if rate not in factors:
+                    factors[rate] = get_factor(rate, included)
+                line_tax = to_decimal(getattr(item, amount_attribute)) * factors[rate]
+                if rounding.per_line:
+                    line_tax = rounding.quantize(line_tax, meta.currency)
+                setattr(item, tax.cache_tax_as, line_tax)
+                column.append(line_tax)
+
+        return rounding.total(column, meta.currency)
+
+
+def get_factor(rate, included):
+    """ Returns the number line amounts are multiplied by to find the tax.
+        If the tax is included in the amount, this is rate / (1 + rate).
+    """
+    rate = to_decimal(rate)
+    if included:
+        return rate / (1 + rate)
+    return rate
+
+
+def load_tax_rates(queryset, key_field="pk", rate_field="tax_rate"):
+    " Loads a mapping of keys to rates from the database, in one query. "
+    return dict(queryset.values_list(key_field, rate_field))
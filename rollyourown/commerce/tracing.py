@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Summary tracing.
+
+    A Tracer can be given to a Summary instance to find out where the time
+    goes when a summary is calculated. It records, for each element:
+
+        * how often it was calculated and how long this took
+        * how many SQL queries were made while calculating it
+        * how often a previously calculated value was reused
+
+    eg:
+
+        >>> tracer = Tracer(sinks=[logging_sink])
+        >>> summary = CartSummary(cart, tracer=tracer)
+        >>> summary.total
+        >>> tracer.report()
+        [{'kind': 'items', 'name': 'items', 'calls': 1, ...}, ...]
+        >>> tracer.emit()
+
+    Times are inclusive, the time for a total includes the time taken to
+    fetch any items it sums. Note that Django only records SQL queries when
+    settings.DEBUG is True, otherwise no queries will be counted.
+
+"""
+import logging
+from time import time
+from django.conf import settings
+from django.db import connections
+from django.utils.datastructures import SortedDict
+
+
+def count_queries():
+    " Returns the number of queries made so far, on all database connections. "
+    if not settings.DEBUG:
+        return 0
+    return sum([len(connection.queries) for connection in connections.all()])
+
+
+class Tracer(object):
+    """ Collects timings, query counts and cache hits for summary elements.
+        Elements are identified by their kind ("items", "item_amount",
+        "extra" or "total") and their name on the Summary class.
+    """
+    def __init__(self, sinks=None):
+        self.sinks = sinks or []
+        self.elements = SortedDict()
+
+    def get_record(self, kind, name):
+        if (kind, name) not in self.elements:
+            self.elements[(kind, name)] = {'kind': kind, 'name': name,
+                                        'calls': 0, 'time': 0.0,
+                                        'max_time': 0.0, 'queries': 0,
+                                        'cache_hits': 0}
+        return self.elements[(kind, name)]
+
+    def start(self, kind, name):
+        """ Starts timing the given element, the returned token is to be
+            passed to stop().
+        """
+        return (kind, name, time(), count_queries())
+
+    def stop(self, token):
+        kind, name, started, queries = token
+        elapsed = time() - started
+        record = self.get_record(kind, name)
+        record['calls'] += 1
+        record['time'] += elapsed
+        record['max_time'] = max(record['max_time'], elapsed)
+        record['queries'] += count_queries() - queries
+
+    def cache_hit(self, kind, name):
+        self.get_record(kind, name)['cache_hits'] += 1
+
+    def report(self):
+        " Returns a list of records, one for each element, in order of use. "
+        return [record.copy() for record in self.elements.values()]
+
+    def emit(self):
+        " Sends the report to each of the sinks. "
+        report = self.report()
+        for sink in self.sinks:
+            sink(report)
+
+
+#
+# Sinks
+#
+# A sink is simply a callable which accepts a report.
+#
+
+def logging_sink(report, logger=logging.getLogger('rollyourown.commerce')):
+    " Logs each record in the report at debug level. "
+    for record in report:
+        logger.debug("%(kind)s %(name)s: %(calls)d calls, %(time).6fs "
+                     "(max %(max_time).6fs), %(queries)d queries, "
+                     "%(cache_hits)d cache hits" % record)
+
+
+class StatsdSink(object):
+    """ Sends the report to a statsd style client, which has timing(name,
+        milliseconds) and incr(name, count) methods.
+    """
+    def __init__(self, client, prefix="commerce"):
+        self.client = client
+        self.prefix = prefix
+
+    def __call__(self, report):
+        for record in report:
+            name = ".".join((self.prefix, record['kind'], record['name']))
+            self.client.timing(name, record['time'] * 1000)
+            self.client.incr(name + ".calls", record['calls'])
+            self.client.incr(name + ".queries", record['queries'])
+            self.client.incr(name + ".cache_hits", record['cache_hits'])
@@ -1,24 +1,75 @@
 from rollyourown.commerce.utils.friendly_id import FriendlyID
 from rollyourown.commerce.utils.formatting import FormattedDecimal
+from rollyourown.commerce.utils.money import Money
+from rollyourown.commerce.utils.fields import FriendlyIDField, FriendlyIDManager
 
-__all__ = ('FriendlyID', 'FormattedDecimal', 'json_summary')
+__all__ = ('FriendlyID', 'FormattedDecimal', 'Money', 'FriendlyIDField',
+           'FriendlyIDManager', 'json_summary', 'stream_json_summaries')
 
+from decimal import Decimal
 from django.utils import simplejson
 from django.core.serializers.json import DjangoJSONEncoder
 
 def json_summary(summary, fields=None):
-    """ serialize the given summary to JSON. """
+    """ Serialize the given summary to JSON. If no fields are given, all
+        elements are included.
+    """
+    return "".join(summary_json_chunks(summary, fields))
 
-    data = {}
-    for items in summary._meta.items.keys():
-        if fields and items in fields:
-            data[items] = dict((i.pk, getattr(i, summary._meta.items[items].cache_amount_as)) for i in getattr(summary, items))
-    for extra in summary._meta.extras:
-        if fields and extra in fields:
-            data[extra] = getattr(summary, extra).amount
-    for total in summary._meta.totals:
-        if fields and total in fields:
-            data[total] = getattr(summary, total)
+def stream_json_summaries(summaries, fields=None):
+    """ Serialize the given summaries as a JSON array, one chunk at a time,
+        so that large exports can be streamed (eg to an HttpResponse).
+    """
+    yield "["
+    separator = ""
+    for summary in summaries:
+        yield separator + json_summary(summary, fields)
+        separator = ","
+    yield "]"
 
-    return simplejson.dumps(data, cls=DjangoJSONEncoder)
+def summary_json_chunks(summary, fields=None):
+    """ Walks through the elements of the summary once, in order, yielding
+        the JSON for each element. Amounts are encoded directly as strings,
+        as DjangoJSONEncoder would.
+    """
+    meta = summary._meta
+    separator = "{"
+    for name in meta.elements:
+        if fields is not None and name not in fields:
+            continue
+        if name in meta.items:
+            attribute_name = meta.items[name].cache_amount_as
+            value = "{%s}" % ",".join(['%s:%s' % (encode_key(i.pk),
+                                            encode_value(getattr(i, attribute_name)))
+                                        for i in getattr(summary, name)])
+        elif name in meta.extras:
+            value = encode_value(getattr(summary, name).amount)
+        elif name in meta.totals:
+            value = encode_value(summary_total(summary, name))
+        else:
+            value = encode_value(getattr(summary, name))
+        yield '%s"%s":%s' % (separator, name, value)
+        separator = ","
+    if separator == "{":
+        yield "{"
+    yield "}"
 
+def summary_total(summary, name):
+    """ Returns the value of the named total, calculating it only once per
+        summary. The value is kept in the summary's cache, so that totals
+        built from other totals reuse it too.
+    """
+    key = ('total', name)
+    if key not in summary._cache:
+        summary._cache[key] = getattr(summary, name)
+    return summary._cache[key]
+
+def encode_key(key):
+    if isinstance(key, (int, long)):
+        return '"%d"' % key
+    return simplejson.dumps(unicode(key))
+
+def encode_value(value):
+    if isinstance(value, (Decimal, Money)):
+        return '"%s"' % str(value)
+    return simplejson.dumps(value, cls=DjangoJSONEncoder)
@@ -0,0 +1,95 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Model helpers for friendly IDs.
+
+    The friendly code is derived from the primary key, so there is no extra
+    column to index or keep up to date: it is encoded when it is read and
+    decoded when it is queried, making a lookup by code a primary key lookup.
+
+        class Order(models.Model):
+            friendly_id = FriendlyIDField()
+            objects = FriendlyIDManager()
+
+        >>> order.friendly_id
+        'KSR68'
+        >>> Order.objects.get_by_friendly_id('KSR68')
+        <Order: Order object>
+
+    Rows created in bulk (eg with executemany or bulk_create) have their codes
+    as soon as they have a primary key, no per-row save is needed.
+
+"""
+from django.db import models
+from rollyourown.commerce.utils.friendly_id import FriendlyID
+
+_default_friendly_id = None
+
+def get_default_friendly_id():
+    " Returns a shared FriendlyID, using the settings' defaults. "
+    global _default_friendly_id
+    if _default_friendly_id is None:
+        _default_friendly_id = FriendlyID()
+    return _default_friendly_id
+
+
+class FriendlyIDField(object):
+    """ Provides the friendly code for a model's primary key, as a read only
+        attribute. Like GenericForeignKey, this is not a real field and has
+        no database column.
+    """
+    def __init__(self, friendly_id=None):
+        self._friendly_id = friendly_id
+
+    @property
+    def friendly_id(self):
+        return self._friendly_id or get_default_friendly_id()
+
+    def contribute_to_class(self, cls, name):
+        self.name = name
+        self.model = cls
+        cls._friendly_id_field = self
+        setattr(cls, name, self)
+
+    def __get__(self, instance, instance_type=None):
+        if instance is None:
+            return self
+        if instance.pk is None:
+            return None
+        return self.friendly_id.encode(instance.pk)
+
+    def __set__(self, instance, value):
+        raise AttributeError("The friendly ID is derived from the primary key and cannot be set.")
+
+
+class FriendlyIDManager(models.Manager):
+    """ Looks up objects by their friendly code. The model's FriendlyIDField
+        is used to decode codes, or the default FriendlyID if there is none.
+    """
+    def get_friendly_id(self):
+        field = getattr(self.model, '_friendly_id_field', None)
+        return field and field.friendly_id or get_default_friendly_id()
+
+    def get_by_friendly_id(self, code):
+        " Returns the object with the given code, raising DoesNotExist if there is none. "
+        pk = self.get_friendly_id().decode(code)
+        if pk is None:
+            raise self.model.DoesNotExist("%s matching friendly ID %r does not exist."
+                                            % (self.model._meta.object_name, code))
+        return self.get(pk=pk)
+
+    def filter_by_friendly_ids(self, codes):
+        " Returns a queryset of the objects with any of the given codes. "
+        friendly_id = self.get_friendly_id()
+        pks = [friendly_id.decode(code) for code in codes]
+        return self.filter(pk__in=[pk for pk in pks if pk is not None])
+
+    def friendly_ids(self, queryset=None):
+        """ Returns a dict mapping primary keys to codes, for the given
+            queryset (or all objects). The codes are encoded in one go, so
+            this is suitable for listings and exports.
+        """
+        if queryset is None:
+            queryset = self.all()
+        pks = list(queryset.values_list('pk', flat=True))
+        return dict(zip(pks, self.get_friendly_id().encode_many(pks)))
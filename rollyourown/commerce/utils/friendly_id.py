@@ -5,8 +5,13 @@
 
      Author: Will Hardy
        Date: December 2008
-      Usage: >>> encode(1)
-             "KSR68"
+      Usage:
+             >>> fi = FriendlyID()
+             >>> fi.encode(1)
+             'F5USF'
+             >>> fi.decode('F5USF')
+             1
+
 Description: Invoice numbers like "0000004" are unprofessional in that they 
              expose how many sales a system has made, and can be used to monitor
              the rate of sales over a given time.  They are also harder for 
@@ -19,6 +24,7 @@ Description: Invoice numbers like "0000004" are unprofessional in that they
 
 """
 import math
+from bisect import bisect_left
 
 # If django is available for settings, import some defaults
 # Alpha numeric characters, only uppercase, no confusing values (eg 1/I,0/O,Z/2)
@@ -36,6 +42,8 @@ DEFAULT_STRING_LENGTH = None
 # million, which is enough for most tasks. The size is increased to match the 
 # order.
 DEFAULT_MINIMUM_LENGTH = 5
+# Strings are built from chunks of this many characters when encoding in bulk
+CHUNK_LENGTH = 3
 
 try:
     from django.conf import settings
@@ -53,9 +61,10 @@ class FriendlyID(object):
         self.valid_chars = valid_chars or DEFAULT_VALID_CHARS
         # For convenience and speed
         self.number_valid_chars = len(self.valid_chars)
+        self.char_values = dict((c, i) for i, c in enumerate(self.valid_chars))
 
-        minimum_length = minimum_length or DEFAULT_MINIMUM_LENGTH
-        self.minimum_size = self.number_valid_chars ** minimum_length - 1
+        self.minimum_length = minimum_length or DEFAULT_MINIMUM_LENGTH
+        self.minimum_size = self.number_valid_chars ** self.minimum_length - 1
 
         # This just means we don't start with the first number, to mix things up
         self.offset_percent = offset_percent or DEFAULT_OFFSET_PERCENT
@@ -63,23 +72,48 @@ class FriendlyID(object):
         # This is used to store already calculated periods, for speed and consistency
         self._period_cache = {}
         self._offset_cache = {}
+        self._inverse_cache = {}
+        self._chunk_table = None
 
         # Don't set this, it isn't necessary and you'll get ugly strings like 'AAAAAB3D'
         # String length is automatically determined. Use only in an emergency
         self.string_length = string_length or DEFAULT_STRING_LENGTH
 
+        # The parameters for each size, (size, period, offset, multiplier, 
+        # string_length), in order. Further sizes are added when needed.
+        # The sizes are also kept in their own list, for bisection.
+        self.tiers = []
+        self._tier_sizes = []
+        self.add_tier()
+
+    def add_tier(self):
+        " Works out the parameters for the next size and adds them to self.tiers. "
+        if self.tiers:
+            size = self._tier_sizes[-1] * self.number_valid_chars
+        else:
+            size = self.minimum_size
+        period = self.get_period(size)
+        tier = (size, period, self.get_offset(size), size / period,
+                                            self.get_string_length(size))
+        self.tiers.append(tier)
+        self._tier_sizes.append(size)
+        return tier
+
+    def get_tier(self, num):
+        " Returns the parameters of the size for the given number. "
+        while num > self._tier_sizes[-1]:
+            self.add_tier()
+        return self.tiers[bisect_left(self._tier_sizes, num)]
+
     def get_size(self, num):
         " Returns the size of the field for the given number. "
-        possible_size = self.minimum_size
-        while num > possible_size:
-            possible_size *= self.number_valid_chars
-        return possible_size
+        return self.get_tier(num)[0]
 
     def get_period(self, size):
         """ Automatically find a suitable period to use.
             Factors are best, because they will have 1 left over when 
             dividing SIZE+1.
-            This only needs to be run once, on import.
+            This only needs to be run once for each size.
         """
         # Check in the cache first
         if size in self._period_cache:
@@ -100,16 +134,19 @@ class FriendlyID(object):
                 # Save to the cache and return
                 self._period_cache[size] = p
                 return p
-        for p in xrange(highest_acceptable_factor, starting_point+1, -1):
-            if size % p == 0:
-                self._period_cache[size] = p
-                return p
+        # This finds the highest factor from the factorisation, rather than
+        # testing every number below the square root of the size.
+        factors = [p for p in divisors(size) 
+                        if starting_point+1 < p <= highest_acceptable_factor]
+        if factors:
+            self._period_cache[size] = max(factors)
+            return max(factors)
         for p in [6,5,4,3,2]:
             if size % p == 0:
                 self._period_cache[size] = p
                 return p
-        raise Exception, "No valid period could be found for SIZE=%d.\n" \
-                         "Try avoiding prime numbers :-)" % SIZE
+        raise ValueError("No valid period could be found for SIZE=%d.\n"
+                         "Try avoiding prime numbers :-)" % size)
 
     def get_offset(self, size):
         return size * self.offset_percent / 100 - 1 
@@ -139,6 +176,30 @@ class FriendlyID(object):
             num = num / self.number_valid_chars
         return string
     
+    def get_inverse(self, size):
+        """ Returns the modular inverse of the perfect hash's multiplier, 
+            which is used to reverse the hash.
+        """
+        if size not in self._inverse_cache:
+            multiplier = size / self.get_period(size)
+            self._inverse_cache[size] = modular_inverse(multiplier, size+1)
+        return self._inverse_cache[size]
+
+    def reverse_hash(self, hash, size):
+        """ Translate a hashed number back to the original number. """
+        return ((hash - 1) * self.get_inverse(size) - self.get_offset(size)) % (size+1)
+
+    def friendly_number(self, string):
+        """ Convert a string of VALID_CHARS back to a number, returning None
+            if the string contains invalid characters.
+        """
+        num = 0
+        for char in string:
+            if char not in self.char_values:
+                return None
+            num = num * self.number_valid_chars + self.char_values[char]
+        return num
+
     def encode(self, num):
         """ Encode a simple number, using a perfect hash and converting to a 
             more user friendly string of characters.
@@ -146,10 +207,149 @@ class FriendlyID(object):
         # Check the number is within our working range
         if num < 0: return None
 
-        size = self.get_size(num)
-        hash = self.perfect_hash(num, size)
-        return self.friendly_string(hash, size)
-    
+        size, period, offset, multiplier, length = self.get_tier(num)
+        hash = ((num + offset) * multiplier) % (size + 1) + 1
+        return self.chunked_string(hash, length)
+
+    def encode_many(self, numbers):
+        """ Encode many numbers at once (eg for backfills), returning a list
+            of strings in the same order. Numbers are grouped by size, so
+            the hash parameters for each size are only worked out once, and
+            strings are built from a table of precomputed character chunks.
+        """
+        numbers = list(numbers)
+        strings = [None] * len(numbers)
+        if not numbers:
+            return strings
+
+        self.get_tier(max(numbers))
+        sizes = self._tier_sizes
+        if max(numbers) <= sizes[0] and min(numbers) >= 0:
+            groups = [range(len(numbers))]
+        else:
+            # Negative numbers are left as None, like encode()
+            tiers = [num < 0 and -1 or bisect_left(sizes, num) for num in numbers]
+            groups = [[i for i, t in enumerate(tiers) if t == tier] 
+                                            for tier in range(len(sizes))]
+
+        table = self.get_chunk_table()
+        chunk_size = len(table)
+        for (size, period, offset, multiplier, length), indexes in zip(self.tiers, groups):
+            if not indexes:
+                continue
+            modulus = size + 1
+            hashes = [((numbers[i] + offset) * multiplier) % modulus + 1 
+                                                            for i in indexes]
+
+            # Common lengths are converted inline, for speed. The leading 
+            # characters of the first chunk are trimmed off.
+            if length <= CHUNK_LENGTH * 2:
+                tier_strings = [(table[h / chunk_size % chunk_size] 
+                                 + table[h % chunk_size])[-length:] 
+                                            for h in hashes]
+            elif length <= CHUNK_LENGTH * 3:
+                tier_strings = [(table[h / chunk_size / chunk_size % chunk_size]
+                                 + table[h / chunk_size % chunk_size] 
+                                 + table[h % chunk_size])[-length:] 
+                                            for h in hashes]
+            else:
+                tier_strings = [self.chunked_string(h, length) for h in hashes]
+
+            for i, string in zip(indexes, tier_strings):
+                strings[i] = string
+        return strings
+
+    def get_string_length(self, size):
+        " Returns the length of the strings friendly_string() produces for the given size. "
+        length = 1
+        while self.number_valid_chars ** length <= size:
+            length += 1
+        if self.string_length:
+            length = max(length, self.string_length + 1)
+        return length
+
+    def get_chunk_table(self):
+        " Returns a list of every string of CHUNK_LENGTH characters, in order. "
+        if self._chunk_table is None:
+            self._chunk_table = [""]
+            for i in range(CHUNK_LENGTH):
+                self._chunk_table = [a + b for a in self._chunk_table 
+                                                for b in self.valid_chars]
+        return self._chunk_table
+
+    def chunked_string(self, num, length):
+        """ Does the same as friendly_string(), but converts CHUNK_LENGTH
+            characters at a time using a lookup table.
+        """
+        table = self.get_chunk_table()
+        chunk_size = len(table)
+        chunks = []
+        for i in range(-(-length / CHUNK_LENGTH)):
+            num, remainder = divmod(num, chunk_size)
+            chunks.append(table[remainder])
+        chunks.reverse()
+        return "".join(chunks)[-length:]
+
+    def decode(self, string):
+        """ Decode a string produced by encode() back to the original number,
+            returning None if the string could not have been produced.
+            Only the sizes that produce strings of this length are tried, 
+            so this takes constant time.
+        """
+        hash = self.friendly_number(string)
+        if hash is None:
+            return None
+
+        index = 0
+        while True:
+            if index == len(self.tiers):
+                self.add_tier()
+            size, period, offset, multiplier, length = self.tiers[index]
+            if length > len(string):
+                return None
+            if length == len(string):
+                num = self.reverse_hash(hash, size)
+                if self.get_size(num) == size and self.encode(num) == string:
+                    return num
+            index += 1
+
+
+def factorise(num):
+    " Returns a dict of the prime factors of the given number and their powers. "
+    factors = {}
+    p = 2
+    while p * p <= num:
+        while num % p == 0:
+            factors[p] = factors.get(p, 0) + 1
+            num /= p
+        p += p == 2 and 1 or 2
+    if num > 1:
+        factors[num] = factors.get(num, 0) + 1
+    return factors
+
+def divisors(num):
+    " Returns a list of all the divisors of the given number, using its factorisation. "
+    result = [1]
+    for prime, power in factorise(num).items():
+        result = [d * prime ** i for d in result for i in range(power+1)]
+    return result
+
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+def modular_inverse(a, m):
+    """ Returns x such that (a * x) % m == 1, using the extended Euclidean
+        algorithm. a and m must be coprime.
+    """
+    x, last_x = 0, 1
+    b = m
+    while b:
+        quotient = a / b
+        a, b = b, a % b
+        x, last_x = last_x - quotient * x, x
+    return last_x % m
 
 def test(max_number):
     """ Test every single value for uniqueness and that they are properly decoded.
@@ -169,6 +369,110 @@ def test(max_number):
 
     return True
 
+def test_decode(fi=None):
+    """ Test that every possible code of the minimum length is decoded to a
+        number, which is encoded back to the same code. As there are as 
+        many codes as numbers of this length, this also shows that every
+        number is properly decoded.
+    """
+    fi = fi or FriendlyID()
+    for hash in xrange(fi.number_valid_chars ** fi.minimum_length):
+        string = fi.friendly_string(hash, fi.minimum_size)
+        num = fi.decode(string)
+        if num is None or fi.encode(num) != string:
+            print string, num
+            return False
+    return True
+
+def verify(max_number, fi=None, empirical=False, processes=None, 
+                                                        window=2**26):
+    """ Verify that every number up to max_number has a unique code, for the
+        given FriendlyID (by default one using the settings). Returns a list
+        of problems, which is empty if the codes are unique.
+
+        Within each size, the perfect hash is a bijection when its multiplier
+        and modulus are coprime, which is checked mathematically. Different
+        sizes only produce different codes if their strings have different
+        lengths, which is not the case when string_length is set.
+
+        If empirical is True, every code is also generated and checked 
+        against a bitset over the space of codes of each length. The code
+        space is divided into windows of the given number of bits, so that
+        memory use is bounded, and windows are checked in parallel using a 
+        pool of processes (the number of CPUs by default).
+    """
+    fi = fi or FriendlyID()
+    problems = []
+    fi.get_tier(max_number)
+
+    # Group the ranges of numbers in each size by the length of their codes
+    lengths = {}
+    lower = 0
+    for size, period, offset, multiplier, length in fi.tiers:
+        if lower > max_number:
+            break
+        if gcd(multiplier, size+1) != 1:
+            problems.append("Perfect hash is not a bijection for SIZE=%d "
+                            "(period %d)" % (size, period))
+        lengths.setdefault(length, []).append((lower, min(size, max_number)))
+        lower = size + 1
+
+    for length, ranges in sorted(lengths.items()):
+        if len(ranges) > 1:
+            problems.append("Numbers %d to %d share codes of length %d, codes "
+                            "may not be unique" % (ranges[0][0], ranges[-1][1], 
+                            length))
+
+    if empirical:
+        config = {'offset_percent': fi.offset_percent, 
+                  'valid_chars': fi.valid_chars, 
+                  'string_length': fi.string_length, 
+                  'minimum_length': fi.minimum_length}
+        jobs = []
+        for length, ranges in sorted(lengths.items()):
+            code_space = fi.number_valid_chars ** length
+            for start in xrange(0, code_space, window):
+                jobs.append((config, length, ranges, start, 
+                                        min(start + window, code_space)))
+        from multiprocessing import Pool
+        pool = Pool(processes)
+        try:
+            for duplicates in pool.imap_unordered(verify_window, jobs):
+                problems.extend("Number %d has the same code as %s: %s" 
+                                % (num, fi.decode(fi.encode(num)), fi.encode(num)) 
+                                for num in duplicates)
+        finally:
+            pool.close()
+            pool.join()
+
+    return problems
+
+def verify_window(job):
+    """ Generates the codes for the given ranges of numbers and checks those
+        in the window [start, end) of the code space for duplicates, using a 
+        bitset. Returns a list of (up to 10) numbers whose code was already
+        used by an earlier number.
+    """
+    config, length, ranges, start, end = job
+    fi = FriendlyID(**config)
+    code_space = fi.number_valid_chars ** length
+    bits = bytearray((end - start + 7) / 8)
+    duplicates = []
+    for lower, upper in ranges:
+        size, period, offset, multiplier, tier_length = fi.get_tier(upper)
+        modulus = size + 1
+        for num in xrange(lower, upper+1):
+            code = (((num + offset) * multiplier) % modulus + 1) % code_space
+            if start <= code < end:
+                index = code - start
+                if bits[index >> 3] & (1 << (index & 7)):
+                    duplicates.append(num)
+                    if len(duplicates) >= 10:
+                        return duplicates
+                else:
+                    bits[index >> 3] |= 1 << (index & 7)
+    return duplicates
+
 def performance_test(num=None):
     """ Run test for the given data to test system performance. 
         (This is used for developing optimisations)
@@ -179,6 +483,23 @@ def performance_test(num=None):
     t = Timer("test(%s)" % num, "from __main__ import test")
     print t.timeit(number=1)
 
+def performance_test_many(num=None):
+    """ Compare the time taken to encode the given number of ids one at a
+        time, with encoding them all at once using encode_many().
+    """
+    if not num:
+        num = 10000000
+    from time import time
+    fi = FriendlyID()
+
+    start = time()
+    [fi.encode(i) for i in xrange(num)]
+    print "encode():      %.2fs" % (time() - start)
+
+    start = time()
+    fi.encode_many(xrange(num))
+    print "encode_many(): %.2fs" % (time() - start)
+
 
 if __name__ == '__main__':
     print "Here's a quick demonstration:"
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+    The Money class is a compact alternative to FormattedDecimal. Amounts are
+    stored as an integer number of minor units (eg cents), and the locale,
+    currency and HTML template are kept in a MoneyContext which is shared by
+    all amounts with the same settings. Adding and comparing amounts is then
+    simple integer arithmetic.
+
+    A summary uses Money for all its amounts when it is given in its Meta:
+
+        class CartSummary(commerce.Summary):
+            ...
+            class Meta:
+                amount_class = Money
+
+    Amounts with more decimal places than the currency has are rounded
+    (ROUND_HALF_EVEN) when they are created. Amounts in different currencies
+    can't be added, subtracted or compared (CurrencyMismatchError is raised),
+    they need to be converted first. For display, amounts are
+    converted to a FormattedDecimal, so they can be used in templates in
+    exactly the same way.
+"""
+
+from decimal import Decimal, ROUND_HALF_EVEN
+from django.conf import settings
+from rollyourown.commerce.utils.formatting import FormattedDecimal, DEFAULT_DECIMAL_HTML, babel
+
+# The number of decimal places, for currencies that don't have 2
+CURRENCY_PLACES = {
+    'JPY': 0, 'KRW': 0, 'ISK': 0, 'CLP': 0, 'VND': 0,
+    'BHD': 3, 'KWD': 3, 'OMR': 3, 'JOD': 3, 'TND': 3,
+    }
+DEFAULT_PLACES = 2
+
+
+class CurrencyMismatchError(ValueError):
+    """ Amounts in different currencies can't be added or compared without
+        being converted first.
+    """
+
+class MoneyContext(object):
+    """ The formatting information shared by many amounts. Use get_context()
+        so that only one context is created for each set of settings.
+    """
+    __slots__ = ('locale', 'currency', 'HTML', 'places', 'factor')
+    _contexts = {}
+
+    def __init__(self, locale, currency, decimal_html, places):
+        self.locale = locale or settings.LANGUAGE_CODE
+        self.currency = currency
+        self.HTML = decimal_html or DEFAULT_DECIMAL_HTML
+        self.places = places
+        self.factor = 10 ** places
+        if babel and isinstance(self.locale, basestring):
+            self.locale = babel.core.Locale.parse(self.locale, sep="-")
+
+    @classmethod
+    def get_context(cls, locale=None, currency=None, decimal_html=None, places=None):
+        if places is None:
+            places = CURRENCY_PLACES.get(currency, DEFAULT_PLACES)
+        if locale is not None and not isinstance(locale, basestring):
+            key = (str(locale), currency, decimal_html, places)
+        else:
+            key = (locale, currency, decimal_html, places)
+        if key not in cls._contexts:
+            cls._contexts[key] = cls(locale, currency, decimal_html, places)
+        return cls._contexts[key]
+
+    @classmethod
+    def for_summary(cls, summary_instance):
+        meta = summary_instance._meta
+        return cls.get_context(meta.locale, meta.currency, meta.decimal_html)
+
+
+class Money(object):
+    """ An amount of money, as an integer number of minor units. """
+    __slots__ = ('minor', 'context')
+
+    def __init__(self, value=0, context=None, summary_instance=None):
+        if context is None:
+            if summary_instance is not None:
+                context = MoneyContext.for_summary(summary_instance)
+            elif isinstance(value, Money):
+                context = value.context
+            else:
+                context = MoneyContext.get_context()
+        self.context = context
+        self.minor = to_minor(value, context)
+
+    @classmethod
+    def from_minor(cls, minor, context):
+        " Creates an amount directly from the number of minor units. "
+        obj = cls.__new__(cls)
+        obj.minor = minor
+        obj.context = context
+        return obj
+
+    @classmethod
+    def from_formatted_decimal(cls, value):
+        context = MoneyContext.get_context(value.locale, value.currency, value.HTML)
+        return cls(value, context)
+
+    def to_decimal(self):
+        return Decimal(self.minor).scaleb(-self.context.places)
+
+    def to_formatted_decimal(self):
+        " Returns an equivalent FormattedDecimal, for display. "
+        value = Decimal.__new__(FormattedDecimal, self.to_decimal())
+        value.locale = self.context.locale
+        value.currency = self.context.currency
+        value.HTML = self.context.HTML
+        return value
+
+    # Formatting, as FormattedDecimal
+    html = property(lambda s: s.to_formatted_decimal().html)
+    elements = property(lambda s: s.to_formatted_decimal().elements)
+    raw = property(lambda s: unicode(s.to_decimal()))
+
+    def __unicode__(self):
+        return unicode(self.to_formatted_decimal())
+
+    def __str__(self):
+        return str(self.to_decimal())
+
+    def __repr__(self):
+        return "Money('%s')" % self
+
+    # Arithmetic, amounts without a context use the context of the other
+    def _other_minor(self, other):
+        if isinstance(other, Money):
+            if other.context is self.context:
+                return other.minor
+            currencies = (self.context.currency, other.context.currency)
+            if None not in currencies and currencies[0] != currencies[1]:
+                raise CurrencyMismatchError("Cannot combine amounts in %s and %s" % currencies)
+        return to_minor(other, self.context)
+
+    def __add__(self, other):
+        try:
+            return Money.from_minor(self.minor + self._other_minor(other), self.context)
+        except TypeError:
+            return NotImplemented
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        try:
+            return Money.from_minor(self.minor - self._other_minor(other), self.context)
+        except TypeError:
+            return NotImplemented
+
+    def __rsub__(self, other):
+        try:
+            return Money.from_minor(self._other_minor(other) - self.minor, self.context)
+        except TypeError:
+            return NotImplemented
+
+    def __mul__(self, other):
+        if isinstance(other, (int, long)):
+            return Money.from_minor(self.minor * other, self.context)
+        if isinstance(other, (Decimal, basestring, float)):
+            return Money(self.to_decimal() * Decimal(str(other)), self.context)
+        return NotImplemented
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money.from_minor(-self.minor, self.context)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Money.from_minor(abs(self.minor), self.context)
+
+    def __nonzero__(self):
+        return self.minor != 0
+
+    def __float__(self):
+        return float(self.minor) / self.context.factor
+
+    def __int__(self):
+        return int(self.to_decimal())
+
+    def __cmp__(self, other):
+        return cmp(self.minor, self._other_minor(other))
+
+    def __eq__(self, other):
+        try:
+            return self.minor == self._other_minor(other)
+        except (TypeError, CurrencyMismatchError):
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.to_decimal())
+
+
+def to_minor(value, context):
+    " Returns the given value as an integer number of minor units. "
+    if isinstance(value, Money):
+        if value.context.places == context.places:
+            return value.minor
+        value = value.to_decimal()
+    if isinstance(value, (int, long)):
+        return value * context.factor
+    if isinstance(value, float):
+        value = str(value)
+    if isinstance(value, basestring):
+        value = Decimal(value)
+    if not isinstance(value, Decimal):
+        raise TypeError("Cannot convert %r to Money" % (value,))
+    return int(value.scaleb(context.places).to_integral_value(rounding=ROUND_HALF_EVEN))
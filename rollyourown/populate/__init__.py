@@ -1,28 +1,60 @@
-
-from rollyourown.populate.data import DEFAULT_GENERATOR_FUNCTIONS
+from rollyourown.populate.data import DEFAULT_GENERATOR_FUNCTIONS, reference_pools, random_streams
 
 from rollyourown.populate.registration import registry, Populator
+from rollyourown.populate.scheduling import dependency_stages, independent, supports_parallel, run_parallel, populate_task, populate_many_to_many_task
+import logging
 
 def register(*args, **kwargs):
     registry.register(*args, **kwargs)
 
 
-def populate_models(models):
-    """ Populates all given models. """
-
-    # Record all the populators we've created
-    populators = {}
+def get_populator(model):
+    """ Returns the registered populator for the given model, or a default
+        one if it isn't registered.
+    """
+    if model in registry:
+        return registry[model]
+    return Populator(model)
 
-    for model in models:
-        if model in registry:
-            populators[model] = registry[model]
-        else:
-            populators[model] = Populator(model)
 
-        populators[model].populate()
+def populate_models(models, processes=None, seed=None):
+    """ Populates all given models, each after the models it references.
+        If a number of processes is given, the models that don't depend on
+        each other are populated at the same time, in separate processes.
+        Many to many connections are made last, once all the models have
+        been populated. If a seed is given, the same data is generated
+        each time (given the same starting database).
+    """
+    if seed is not None:
+        random_streams.seed(seed)
 
-    for model, populator in populators.items():
-        populator.populate_many_to_many()
+    # Record all the populators we've created, and the objects they created
+    populators = {}
+    pks = {}
+    parallel = processes and processes > 1
+    if parallel and not supports_parallel(models):
+        logging.warning("SQLite does not allow concurrent writes, populating in a single process.")
+        parallel = False
+
+    for stage in dependency_stages(models):
+        stage_populators = dict([(model, get_populator(model)) for model in stage])
+        populators.update(stage_populators)
+
+        if parallel and len(stage) > 1 and independent(stage):
+            pks.update(run_parallel(populate_task, stage_populators, processes))
+            # The objects were created elsewhere, so the pools need reloading
+            for model in stage:
+                reference_pools.reset(model)
+        else:
+            for model in stage:
+                stage_populators[model].populate()
+                pks[model] = stage_populators[model].pks
+
+    if parallel and len(populators) > 1:
+        run_parallel(populate_many_to_many_task, populators, processes, pks)
+    else:
+        for model, populator in populators.items():
+            populator.populate_many_to_many(pks[model])
 
 
 # Version information
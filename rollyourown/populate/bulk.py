@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+
+""" Bulk inserts for populating large numbers of rows.
+    Django's bulk_create() is used where it is available, otherwise the rows
+    are inserted with a single executemany() call.
+"""
+
+from django.db import connections, router, transaction
+from django.db.models import AutoField, Max
+
+
+def bulk_insert(model, instances, set_pks=True):
+    """ Inserts the given (unsaved) instances, filling in their primary keys
+        if the database doesn't (and set_pks is True). This should be called
+        inside a transaction.
+    """
+    if not instances:
+        return
+    using = router.db_for_write(model)
+    pk_field = model._meta.pk
+    last_pk = None
+    if set_pks and isinstance(pk_field, AutoField):
+        last_pk = model._default_manager.db_manager(using).aggregate(last=Max('pk'))['last'] or 0
+
+    if hasattr(model._default_manager, 'bulk_create'):
+        model._default_manager.db_manager(using).bulk_create(instances)
+    else:
+        connection = connections[using]
+        fields = [f for f in model._meta.local_fields if not isinstance(f, AutoField)]
+        rows = [[f.get_db_prep_save(f.pre_save(instance, True), connection=connection)
+                                for f in fields] for instance in instances]
+        insert_rows(connection, model._meta.db_table, [f.column for f in fields], rows)
+
+    if last_pk is not None and instances[0].pk is None:
+        assign_pks(model, instances, last_pk, using)
+
+
+def insert_rows(connection, table, columns, rows):
+    " Inserts the given rows with a single executemany(). "
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(table),
+                                        ", ".join([qn(c) for c in columns]),
+                                        ", ".join(["%s"] * len(columns)))
+    connection.cursor().executemany(sql, rows)
+    mark_dirty(connection.alias)
+
+
+def mark_dirty(using):
+    """ Raw queries don't tell the transaction management that there is
+        something to commit, so they need to say so themselves.
+    """
+    if transaction.is_managed(using=using):
+        transaction.set_dirty(using=using)
+    else:
+        transaction.commit_unless_managed(using=using)
+
+
+def assign_pks(model, instances, last_pk, using=None):
+    """ Sets the primary key of each instance after a bulk insert, using the
+        keys created after last_pk. The rows are assumed to have been given
+        keys in the order they were inserted, as an auto increment does.
+    """
+    pks = model._default_manager.db_manager(using).filter(pk__gt=last_pk
+                        ).order_by('pk').values_list('pk', flat=True)
+    pks = list(pks[:len(instances)])
+    if len(pks) == len(instances):
+        for instance, pk in zip(instances, pks):
+            instance.pk = pk
@@ -5,168 +5,433 @@
 """
 
 import os, string, random
+from hashlib import md5
 from decimal import Decimal
-from datetime import date, datetime, timedelta
+from datetime import datetime, timedelta
 from django.template.defaultfilters import slugify, linebreaks
 from django.contrib.webdesign import lorem_ipsum
 
+# RANDOM NUMBERS
+
+# The time used as "now" by seeded runs, so that they don't depend on the day
+SEEDED_NOW = datetime(2010, 1, 1)
+
+class RandomStreams(object):
+    """ A separate random number generator for each field of each model, in
+        each task (eg populating a model or its many to many fields). When a
+        seed is given, each generator is seeded from the seed and its name,
+        so the values don't depend on the order the tasks are run in, or on
+        the process they are run in. Without a seed, the random module is
+        used.
+    """
+    def __init__(self):
+        self.seed()
+
+    def seed(self, seed=None, now=None):
+        self.seed_value = seed
+        self.streams = {}
+        self.task = ()
+        self.fixed_now = now or (seed is not None and SEEDED_NOW or None)
+
+    def begin(self, *task):
+        " Sets the current task, which the following streams belong to. "
+        self.task = tuple([str(name) for name in task])
+
+    def get(self, *names):
+        if self.seed_value is None:
+            return random
+        key = self.task + tuple([str(name) for name in names])
+        if key not in self.streams:
+            digest = md5(":".join((str(self.seed_value),) + key)).hexdigest()
+            self.streams[key] = random.Random(int(digest, 16))
+        return self.streams[key]
+
+    def now(self):
+        return self.fixed_now or datetime.now()
+
+random_streams = RandomStreams()
+
+def random_for(field):
+    " Returns the random number generator for the given field. "
+    opts = field.model._meta
+    return random_streams.get(opts.app_label, opts.object_name, field.name)
+
+def lorem_words(rng, count):
+    return u' '.join(rng.sample(lorem_ipsum.WORDS, count))
+
+def lorem_paragraphs(rng, count):
+    """ Returns paragraphs like lorem_ipsum.paragraphs(count, common=False),
+        using the given random number generator.
+    """
+    paragraphs = []
+    for i in range(count):
+        sentences = []
+        for j in range(rng.randint(1, 4)):
+            sections = [lorem_words(rng, rng.randint(3, 12)) for k in range(rng.randint(1, 5))]
+            sentence = u', '.join(sections)
+            sentences.append(u'%s%s%s' % (sentence[0].upper(), sentence[1:], rng.choice('?.')))
+        paragraphs.append(u' '.join(sentences))
+    return paragraphs
+
+class LoremText(object):
+    """ Lorem ipsum text, generated afresh for each value. """
+    def words(self, rng, count):
+        return lorem_words(rng, count)
+
+    def slug(self, rng):
+        return slugify(self.words(rng, 3))
+
+    def plaintext(self, rng):
+        return "\n\n".join(lorem_paragraphs(rng, 3))
+
+    def html(self, rng):
+        text = "\n\n".join([ htmlify(p, rng) for p in lorem_paragraphs(rng, 3) ])
+        return linebreaks(text)
+
+class PooledText(LoremText):
+    """ Lorem ipsum text chosen from pools of text generated once (when
+        first needed). Values are chosen by index, which is much faster than
+        generating and marking up new text, while giving similar text.
+    """
+    def __init__(self, size=500):
+        self.size = size
+        self.word_list = None
+
+    def fill(self):
+        # The pools are the same for every run, so seeded runs are repeatable
+        rng = random.Random(self.size)
+        self.word_list = list(lorem_ipsum.WORDS)
+        self.slugs = [LoremText.slug(self, rng) for i in range(self.size)]
+        self.plaintexts = [LoremText.plaintext(self, rng) for i in range(self.size)]
+        self.htmls = [LoremText.html(self, rng) for i in range(self.size)]
+
+    def choose(self, rng, pool):
+        return pool[int(rng.random() * len(pool))]
+
+    def words(self, rng, count):
+        if self.word_list is None:
+            self.fill()
+        return u' '.join([self.choose(rng, self.word_list) for i in range(count)])
+
+    def slug(self, rng):
+        if self.word_list is None:
+            self.fill()
+        return self.choose(rng, self.slugs)
+
+    def plaintext(self, rng):
+        if self.word_list is None:
+            self.fill()
+        return self.choose(rng, self.plaintexts)
+
+    def html(self, rng):
+        if self.word_list is None:
+            self.fill()
+        return self.choose(rng, self.htmls)
+
+lorem_text = LoremText()
+pooled_text = PooledText()
+
+def text_source(fast_text):
+    """ Returns the source of generated text. Pooled text is used if
+        fast_text is set, otherwise the text is generated for each value.
+    """
+    return fast_text and pooled_text or lorem_text
+
 # FUNCTIONS
 
-def generate_chars(field, instance, counter):
+def generate_chars(field, instance, counter, fast_text=False):
     """ Generates a 2-4 word title. """
+    rng = random_for(field)
     if 'phone' in field.name or 'mobile' in field.name or 'fax' in field.name:
         return generate_phone(field, instance, counter)
     if 'address' in field.name:
-        return generate_address(field, instance, counter).splitlines()[0]
+        return generate_address(field, instance, counter, fast_text).splitlines()[0]
     max_length = int(field.max_length)
     if max_length < 15:
-        length = random.randint(1, max_length)
+        length = rng.randint(1, max_length)
         if 'number' in field.name or 'postcode' in field.name or 'zip' in field.name:
-            return "".join([random.choice(string.digits) for i in range(length)])
+            return "".join([rng.choice(string.digits) for i in range(length)])
         else:
-            length = random.randint(1, max_length)
-            return "".join([random.choice(string.ascii_letters) for i in range(length)])
+            length = rng.randint(1, max_length)
+            return "".join([rng.choice(string.ascii_letters) for i in range(length)])
     elif max_length < 25:
-        return lorem_ipsum.words(1, common=False).title()[:max_length]
+        return text_source(fast_text).words(rng, 1).title()[:max_length]
     elif max_length < 70:
-        return lorem_ipsum.words(2, common=False).title()[:max_length]
+        return text_source(fast_text).words(rng, 2).title()[:max_length]
     else:
-        return lorem_ipsum.words(3, common=False).title()[:max_length]
+        return text_source(fast_text).words(rng, 3).title()[:max_length]
 
-def generate_text(field, instance, counter):
+def generate_text(field, instance, counter, fast_text=False):
     """ Generates a number of paragraphs of text. """
     if 'address' in field.name:
-        return generate_address(field, instance, counter)
-    return generate_html(field, instance, counter)
+        return generate_address(field, instance, counter, fast_text)
+    return generate_html(field, instance, counter, fast_text)
 
 def generate_phone(field, instance, counter):
+    rng = random_for(field)
     prefix = '(03)'
     digits = min((8, field.max_length-2-len(prefix)))
-    value = str(random.randint(10**8, 10**9-1))
+    value = str(rng.randint(10**8, 10**9-1))
     return ' '.join((prefix, value[:digits/2], value[digits/2:]))
 
-def generate_address(field, instance, counter):
+def generate_address(field, instance, counter, fast_text=False):
+    rng = random_for(field)
     # TODO: Replace this with a corpus of entertainingly varied 
     # (and possibly localised) addresses.
     country = "Australia"
-    lorem = lorem_ipsum.words(3, common=False).title().split()
+    lorem = text_source(fast_text).words(rng, 3).title().split()
     lines = []
-    lines.append('%d %s %s' % (random.randint(0,999), lorem[0], random.choice(("St", "Rd", "Crt", "Ave"))))
-    lines.append('%s, %s %d' % (lorem[1], lorem[2], random.randint(1000, 9999)))
+    lines.append('%d %s %s' % (rng.randint(0,999), lorem[0], rng.choice(("St", "Rd", "Crt", "Ave"))))
+    lines.append('%s, %s %d' % (lorem[1], lorem[2], rng.randint(1000, 9999)))
     lines.append(country)
     return '\n'.join(lines)
 
-def generate_plaintext(field, instance, counter):
+def generate_plaintext(field, instance, counter, fast_text=False):
     """ Generates several paragraphs of plain text. """
-    plaintext = "\n\n".join(lorem_ipsum.paragraphs(3, common=False))
-    return plaintext
+    return text_source(fast_text).plaintext(random_for(field))
 
-def generate_html(field, instance, counter):
-    """ Generates several paragraphs of plain text. """
-    paragraphs = lorem_ipsum.paragraphs(3, common=False)
-    text = "\n\n".join([ htmlify(p) for p in paragraphs ])
-    html = linebreaks(text)
-    return html
+def generate_html(field, instance, counter, fast_text=False):
+    """ Generates several paragraphs of marked up text. """
+    return text_source(fast_text).html(random_for(field))
 
-def htmlify(text):
+def htmlify(text, rng=random):
     words = text.split()
     num_words = len(words)
     # Randomly make some text strong or italic
-    strong = random.randint(0,num_words-1)
+    strong = rng.randint(0,num_words-1)
     words[strong] = "<strong>%s</strong>" % words[strong]
-    em = random.randint(0,num_words-1)
+    em = rng.randint(0,num_words-1)
     words[em] = "<em>%s</em>" % words[em]
-    link = random.randint(0,num_words-3)
+    link = rng.randint(0,num_words-3)
     words[link:link+2] = ['<a href="#">%s</a>' % " ".join(words[link:link+2])]
     return " ".join(words)
 
-def generate_slug(field, instance, counter):
-    return slugify(lorem_ipsum.words(3, common=False))
+def generate_slug(field, instance, counter, fast_text=False):
+    return text_source(fast_text).slug(random_for(field))
+
+# The populator's fast_text setting is passed to these
+generate_chars.options = generate_text.options = generate_slug.options = ('fast_text',)
+generate_address.options = generate_plaintext.options = generate_html.options = ('fast_text',)
 
 def generate_integer(field, instance, counter):
+    rng = random_for(field)
     small = True
     positive = True
     max = small and 255 or 100000
     min = not positive and -max or 0
-    return random.randint(min, max)
+    return rng.randint(min, max)
 
 def generate_boolean(field, instance, counter):
+    rng = random_for(field)
     # bias in favor of True for active flags
     if field.name == 'is_active' or field.name == 'active':
-        return random.choice((True, True, True, False))
+        return rng.choice((True, True, True, False))
     else:
-        return random.choice((True, False))
+        return rng.choice((True, False))
 
 def generate_date(field, instance, counter):
-    min_date = date.today() - timedelta(days=365*5)
-    max_date = date.today() + timedelta(days=365*5)
-    return min_date + timedelta(days=random.randint(0, (max_date - min_date).days))
+    rng = random_for(field)
+    today = random_streams.now().date()
+    min_date = today - timedelta(days=365*5)
+    max_date = today + timedelta(days=365*5)
+    return min_date + timedelta(days=rng.randint(0, (max_date - min_date).days))
 
 def generate_datetime(field, instance, counter):
+    rng = random_for(field)
     min_date = max_date = None
     # TODO: Automatically detect all past-only fields, being fields ending with 'ed'
     if field.name.endswith('created') or field.name.endswith('added') or field.name.endswith('paid'):
-        max_date = datetime.now()
-    min_date = min_date or datetime.now() - timedelta(days=365*5)
-    max_date = max_date or datetime.now() + timedelta(days=365*5)
+        max_date = random_streams.now()
+    min_date = min_date or random_streams.now() - timedelta(days=365*5)
+    max_date = max_date or random_streams.now() + timedelta(days=365*5)
 
-    return min_date + timedelta(days=random.randint(0, (max_date - min_date).days), seconds=random.randint(0,60*60*24))
+    return min_date + timedelta(days=rng.randint(0, (max_date - min_date).days), seconds=rng.randint(0,60*60*24))
 
 def generate_decimal(field, instance, counter):
+    rng = random_for(field)
     max_places = field.decimal_places
-    digits = random.randint(1, field.max_digits)
-    value = str(random.randint(10**digits))
+    digits = rng.randint(1, field.max_digits)
+    value = str(rng.randint(0, 10**digits - 1))
     value = ".".join((value[:-max_places], value[-max_places:]))
     return Decimal(value)
 
 def generate_email(field, instance, counter):
+    rng = random_for(field)
     # TODO: hmmmm
     #domains = ("gmail.com", "hotmail.com")
     domains = ("willhardy.com.au",)
     names = ("will",)
-    return '@'.join((random.choice(names), random.choice(domains)))
+    return '@'.join((rng.choice(names), rng.choice(domains)))
 
-def generate_file(field, instance, counter):
-    return generate_image(field, instance, counter)
+def generate_file(field, instance, counter, share_files=False):
+    return generate_image(field, instance, counter, share_files)
 
 def generate_filepath(field, instance, counter):
     pass
 
 def generate_float(field, instance, counter):
-    return random.random()
+    rng = random_for(field)
+    return rng.random()
 
-def generate_image(field, instance, counter):
+def generate_image(field, instance, counter, share_files=False):
+    """ Chooses a file from the data_files directory. If share_files is
+        set, the name of a copy stored earlier for this field is returned,
+        otherwise the filename and content for a new copy.
+    """
     from django.core.files.base import ContentFile 
+    rng = random_for(field)
     directory = os.path.join(os.path.dirname(__file__), 'data_files')
     if 'logo' in field.name:
         directory = os.path.join(directory, 'logos')
-    filename_choices = [f for f in os.listdir(directory) if not f.startswith(".")]
-    filename = random.choice([f for f in filename_choices if (not f.startswith(".") and "." in f)])
-    return (filename, ContentFile(open(os.path.join(directory, filename), "r").read()))
+    corpus = file_corpora.get_corpus(directory)
+    filename = rng.choice(corpus.filenames)
+    if share_files:
+        return corpus.stored_name(field, instance, filename)
+    return (filename, ContentFile(corpus.read(filename)))
 
 def add_image_to_instance(field, instance, value):
-    getattr(instance, field.name).save(save=False, *value)
+    if isinstance(value, basestring):
+        setattr(instance, field.attname, value)
+    else:
+        getattr(instance, field.name).save(save=False, *value)
 generate_image.add_to_instance = add_image_to_instance
+generate_file.add_to_instance = add_image_to_instance
+# The populator's share_files setting is passed to these
+generate_image.options = generate_file.options = ('share_files',)
+
+class FileCorpus(object):
+    """ The files in a directory, which is listed once. Each file is read
+        once, and stored once per field if share_files is used.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.filenames = sorted([f for f in os.listdir(directory) if not f.startswith(".") and "." in f])
+        self.contents = {}
+        self.stored = {}
+
+    def read(self, filename):
+        if filename not in self.contents:
+            self.contents[filename] = open(os.path.join(self.directory, filename), "rb").read()
+        return self.contents[filename]
+
+    def stored_name(self, field, instance, filename):
+        from django.core.files.base import ContentFile 
+        key = (field.model, field.name, filename)
+        if key not in self.stored:
+            name = field.generate_filename(instance, filename)
+            self.stored[key] = field.storage.save(name, ContentFile(self.read(filename)))
+        return self.stored[key]
+
+class FileCorpora(object):
+    """ The file corpus for each directory, created when first needed. """
+    def __init__(self):
+        self.corpora = {}
+
+    def get_corpus(self, directory):
+        if directory not in self.corpora:
+            self.corpora[directory] = FileCorpus(directory)
+        return self.corpora[directory]
+
+    def clear(self):
+        self.corpora = {}
+
+file_corpora = FileCorpora()
 
 def generate_ipaddress(field, instance, counter):
-    number = random.randint(0, 2**32-1)
+    rng = random_for(field)
+    number = rng.randint(0, 2**32-1)
     return '.'.join([str((number>>(i*8)) % 256) for i in range(4)])
 
 def generate_url(field, instance, counter):
+    rng = random_for(field)
     # hmmmm
     domains = ('http://willhardy.com.au',)
-    return random.choice(domains)
+    return rng.choice(domains)
 
 def generate_reference(field, instance, counter):
-    return field.rel.to._default_manager.all().order_by("?")[0]
+    """ Chooses a related object from a pool of primary keys, the value is
+        assigned directly to the field's attname (eg product_id).
+    """
+    pool = reference_pools.get_pool(field.rel.to, field.rel.field_name)
+    if not pool.values:
+        if field.null:
+            return None
+        raise IndexError("There are no %s objects to reference." % field.rel.to._meta.object_name)
+    return random_for(field).choice(pool.values)
+
+def add_reference_to_instance(field, instance, value):
+    setattr(instance, field.attname, value)
+generate_reference.add_to_instance = add_reference_to_instance
+
+class ReferencePool(object):
+    """ The values of a field (usually the primary key) of a model, which
+        references can be chosen from. These are loaded from the database
+        once, as a random sample if there are more than max_size rows.
+    """
+    def __init__(self, model, field_name, max_size=10000):
+        self.model = model
+        self.field_name = field_name
+        self.max_size = max_size
+        self.refresh()
+
+    def refresh(self):
+        queryset = self.model._default_manager.order_by(self.field_name)
+        self.rng = random_streams.get('pool', self.model._meta.app_label, self.model._meta.object_name, self.field_name)
+        if queryset.count() <= self.max_size:
+            self.values = list(queryset.values_list(self.field_name, flat=True))
+        elif self.rng is random:
+            self.values = list(queryset.order_by('?').values_list(self.field_name, flat=True)[:self.max_size])
+        else:
+            # A seeded sample has to be taken from a known order
+            self.values = self.rng.sample(list(queryset.values_list(self.field_name, flat=True)), self.max_size)
+
+    def add(self, values):
+        """ Adds newly created values. Once the pool is full, new values
+            replace random existing ones, to keep the sample representative.
+        """
+        for value in values:
+            if len(self.values) < self.max_size:
+                self.values.append(value)
+            else:
+                self.values[self.rng.randint(0, self.max_size - 1)] = value
+
+class ReferencePools(object):
+    """ The reference pools for each model, created when first needed. """
+    def __init__(self):
+        self.pools = {}
+
+    def get_pool(self, model, field_name):
+        if (model, field_name) not in self.pools:
+            self.pools[(model, field_name)] = ReferencePool(model, field_name)
+        return self.pools[(model, field_name)]
+
+    def add(self, model, instances):
+        """ Adds newly created instances to any pools for their model. """
+        for (pool_model, field_name), pool in self.pools.items():
+            if pool_model is model:
+                pool.add([getattr(i, field_name) for i in instances])
+
+    def reset(self, model):
+        """ Forgets the pools of the given model (eg when its objects have
+            been deleted).
+        """
+        for key in self.pools.keys():
+            if key[0] is model:
+                del self.pools[key]
+
+    def clear(self):
+        self.pools = {}
+
+reference_pools = ReferencePools()
 
 def generate_point(field, instance, counter):
     from django.contrib.gis.geos import Point
+    rng = random_for(field)
     x_around = 144.940
     y_around = -37.814
 
-    x = x_around is not None and (x_around + (random.random() - 0.5)) or (random_random() - 0.5) * 360
-    y = y_around is not None and (y_around + (random.random() - 0.5)) or (random_randint() - 0.5) * 180
+    x = x_around is not None and (x_around + (rng.random() - 0.5)) or (random_random() - 0.5) * 360
+    y = y_around is not None and (y_around + (rng.random() - 0.5)) or (random_randint() - 0.5) * 180
     return Point(x, y)
 
 DEFAULT_GENERATOR_FUNCTIONS = {
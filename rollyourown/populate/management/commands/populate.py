@@ -20,20 +20,20 @@ Description:
     important.
 
 Improvements:
-    * uniqueness
     * populate.py to force data type
     * populate.py to provide data set
     * populate.py to provide function to provide data
-    * serialise new objects, creating test_data.json fixture for slow populate
 
 
 """
 
+from optparse import make_option
 from django.core.exceptions import ImproperlyConfigured
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import get_app, get_apps, get_model, get_models
 
-from rollyourown.populate import populate_models
+from rollyourown.populate import populate_models, dependency_stages
+from rollyourown.populate import snapshot
 
 # A handy shortcut for getting the full model name
 full_model_name = lambda m: ".".join((m._meta.app_label, m._meta.object_name))
@@ -41,13 +41,37 @@ full_model_name = lambda m: ".".join((m._meta.app_label, m._meta.object_name))
 class Command(BaseCommand):
     help = 'Populates the given app with random test data.'
     args = '[appname ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', dest='processes', type='int', default=None,
+            help='Populate independent models at the same time, using this many processes.'),
+        make_option('--seed', dest='seed', type='int', default=None,
+            help='Seed the random data, so that runs with the same seed generate the same data.'),
+        make_option('--dump', dest='dump', default=None,
+            help='Write the populated tables to this file (gzipped if it ends in .gz).'),
+        make_option('--load', dest='load', default=None,
+            help='Load the tables from this file, written by --dump, instead of populating.'),
+        )
 
     def handle(self, *app_labels, **options):
 
+        if options.get('load'):
+            try:
+                counts = snapshot.load(options['load'])
+            except snapshot.SnapshotError, e:
+                raise CommandError(str(e))
+            for model, count in counts.items():
+                print "Loaded %d instances of %s" % (count, full_model_name(model))
+            return
+
         # Get the models we want to export
         models = get_models_to_populate(app_labels)
 
-        populate_models(models)
+        populate_models(models, processes=options.get('processes'), seed=options.get('seed'))
+
+        if options.get('dump'):
+            models = [m for stage in dependency_stages(models) for m in stage]
+            count = snapshot.dump(models, options['dump'])
+            print "Wrote %d rows to %s" % (count, options['dump'])
 
 
 def get_models_to_populate(app_labels):
@@ -79,84 +79,283 @@ class PopulateCache(object):
             raise NotRegistered('%s not in registry (%s)' % (model.__name__, self.models))
 
 from rollyourown.populate import DEFAULT_GENERATOR_FUNCTIONS
-import random
+from rollyourown.populate.data import reference_pools, random_streams, random_for
+from functools import partial
+from rollyourown.populate.bulk import bulk_insert
+from time import time
 import logging
 
 class Populator(object):
-    def __init__(self, model, instances=10, clear_existing=False, data_functions=None, max_many_to_many_connections=5):
+    def __init__(self, model, instances=10, clear_existing=False, data_functions=None, max_many_to_many_connections=5, chunk_size=None, share_files=False, fast_text=False, max_unique_attempts=10):
         self.model = model
         self.number_instances = instances
         self.clear_existing = clear_existing
         self.data_functions = data_functions
-        self.instances = []
+        # The primary keys of the created objects (the objects themselves
+        # aren't kept, there could be millions of them)
+        self.pks = []
         self.max_many_to_many_connections = max_many_to_many_connections
+        # If a chunk size is given, instances are inserted in bulk, one 
+        # transaction per chunk.
+        self.chunk_size = chunk_size
+        # If set, file fields reference one stored copy of each file
+        self.share_files = share_files
+        # If set, text is chosen from pools generated once
+        self.fast_text = fast_text
+        # The number of times values are generated again for unique fields
+        self.max_unique_attempts = max_unique_attempts
+        self.unique_values = None
+        self._plan = None
 
     def populate(self):
-        if not self.instances:
+        if not self.pks:
+            begin_task('populate', self.model)
             # Delete all existing objects, only if it was asked for and we have testing mode
             if self.clear_existing:
                 self.model._default_manager.all().delete()
+                reference_pools.reset(self.model)
+            self.unique_values = UniqueValues(self.model)
 
-            for i in range(self.number_instances):
-                instance = self.populate_instance(i)
-                self.instances.append(instance)
-            print "Created %d instances of %s.%s" % (len(self.instances), self.model._meta.app_label, self.model._meta.object_name)
-        logging.debug("Populator.populate() called twice on instance.")
+            start = time()
+            # Models with parents need a row in each table, so are saved normally
+            if self.chunk_size and not self.model._meta.parents:
+                for i in range(0, self.number_instances, self.chunk_size):
+                    self.add_created(self.populate_chunk(i, min(self.chunk_size, self.number_instances - i)))
+            else:
+                for i in range(self.number_instances):
+                    instance = self.populate_instance(i)
+                    if instance is not None:
+                        self.add_created([instance])
+            elapsed = time() - start
+            print "Created %d of %d instances of %s.%s in %.1fs (%d rows/sec)" % (len(self.pks), self.number_instances, self.model._meta.app_label, self.model._meta.object_name, elapsed, len(self.pks) / max(elapsed, 0.001))
+        else:
+            logging.debug("Populator.populate() called twice on instance.")
 
-    def populate_instance(self, counter=None):
-        instance = self.model()
+    def add_created(self, instances):
+        """ Keeps the primary keys of newly saved instances, which can be
+            referenced by the models populated later.
+        """
+        instances = [i for i in instances if i.pk is not None]
+        reference_pools.add(self.model, instances)
+        self.pks.extend([i.pk for i in instances])
 
-        for field in self.model._meta.fields:
-            # If choices are given, use those exclusively
-            if field.choices:
-                setattr(instance, field.name, random.choice(field.choices)[0])
-            # If this field accepts a blank value, leave it blank sometimes (not so often though)
-            elif blankable(field):
-                pass
-            else:
-                generator_function = DEFAULT_GENERATOR_FUNCTIONS.get(field.__class__.__name__, None)
-                if not generator_function:
-                    generator_function = DEFAULT_GENERATOR_FUNCTIONS.get(field.get_internal_type(), None)
-                if generator_function:
-                    value = generator_function(field, instance, counter)
-                    if hasattr(generator_function, 'add_to_instance'):
-                        generator_function.add_to_instance(field, instance, value)
-                    else:
-                        setattr(instance, field.name, value)
+    def populate_chunk(self, start, size):
+        """ Builds the given number of instances and inserts them in bulk, 
+            in a single transaction.
+        """
+        instances = [self.build_unique_instance(counter) for counter in range(start, start + size)]
+        instances = [i for i in instances if i is not None]
+        transaction.commit_on_success(bulk_insert)(self.model, instances)
+        return instances
+
+    def populate_instance(self, counter=None):
+        """ Builds and saves an instance, returning None if no unique values
+            were found or it could not be saved.
+        """
+        instance = self.build_unique_instance(counter)
+        if instance is None:
+            return None
     
         transaction.enter_transaction_management()
         transaction.managed(True)
         try:
-            instance.save()
-        except:
-            transaction.rollback()
-            #logging.debug(repr(instance.__dict__))
-            #raise
-        else:
-            transaction.commit()
+            try:
+                instance.save()
+            except Exception, e:
+                transaction.rollback()
+                logging.debug("Could not save %s: %s" % (self.model._meta.object_name, e))
+                return None
+            else:
+                transaction.commit()
+        finally:
+            transaction.leave_transaction_management()
     
         return instance
 
-    def populate_many_to_many(self):
-        # Many to Many fields are special, they need to be added after saving
-        # TODO: ManyToMany with through= attributes may need some help here
-
-        for instance in self.instances:
-            for field in self.model._meta.many_to_many:
-                rel_to_instances = list(field.rel.to._default_manager.all().order_by('?')[:self.max_many_to_many_connections])
-                for i in range(random.randint(0,len(rel_to_instances))):
-                    getattr(instance, field.name).add(rel_to_instances[i])
-
-
-def blankable(field):
-    """ If a given can be made blank. """
-    return (not field.editable and not field.default == datetime.now) or (
-        # Blank values need to be valid
-        field.blank 
-        # Lets only do this once in a while
-        and random.choice((True, False, False, False)) 
-        # Lets not have half the data being the same
-        and not field.default == datetime.now 
-        )
-        
+    def build_instance(self, counter=None):
+        """ Returns a new (unsaved) instance with generated data. """
+        instance = self.model()
+
+        for field, step in self.get_plan():
+            step(instance, counter)
+        return instance
+
+    def get_plan(self):
+        """ Returns the steps for generating an instance, as a list of 
+            (field, step) pairs, where step(instance, counter, allow_blank)
+            sets a value for the field. The plan is worked out once for the
+            model.
+        """
+        if self._plan is None:
+            self._plan = []
+            for field in self.model._meta.fields:
+                step = self.compile_field(field)
+                if step is not None:
+                    self._plan.append((field, step))
+            self._steps = dict(self._plan)
+        return self._plan
+
+    def compile_field(self, field):
+        """ Returns a function which sets a generated value for the given 
+            field on an instance, or None if the field is always left blank
+            (or there is no way to generate a value).
+        """
+        data_functions = self.data_functions or {}
+        sometimes_blank = False
+
+        # Data functions given when registering take precedence
+        if field.name in data_functions:
+            generator_function = data_functions[field.name]
+        # If choices are given, use those exclusively
+        elif field.choices:
+            generator_function = generate_choice
+        # Fields that can't be edited are left alone
+        elif not field.editable and not field.default == datetime.now:
+            return None
+        else:
+            generator_function = DEFAULT_GENERATOR_FUNCTIONS.get(field.__class__.__name__, None)
+            if not generator_function:
+                generator_function = DEFAULT_GENERATOR_FUNCTIONS.get(field.get_internal_type(), None)
+            if not generator_function:
+                return None
+            # If this field accepts a blank value, leave it blank sometimes
+            # (not so often though, and lets not have half the data being the same)
+            sometimes_blank = field.blank and not field.default == datetime.now
+
+        add_to_instance = getattr(generator_function, 'add_to_instance', None)
+        # Generators can ask for some of the populator's settings
+        options = getattr(generator_function, 'options', ())
+        if options:
+            generator_function = partial(generator_function,
+                                    **dict([(option, getattr(self, option)) for option in options]))
+        name = field.name
+
+        def step(instance, counter, allow_blank=True):
+            if allow_blank and sometimes_blank and random_for(field).choice(BLANK_CHOICES):
+                return
+            value = generator_function(field, instance, counter)
+            if add_to_instance is not None:
+                add_to_instance(field, instance, value)
+            else:
+                setattr(instance, name, value)
+        return step
+
+    def generate_value(self, field, instance, counter=None, allow_blank=True):
+        """ Sets a generated value for the given field on the instance.
+            If allow_blank is False, the field is never left blank.
+        """
+        self.get_plan()
+        if field in self._steps:
+            self._steps[field](instance, counter, allow_blank)
+
+    def build_unique_instance(self, counter=None):
+        """ Builds an instance, generating the values of its unique fields
+            (and unique_together sets) again until they haven't been used.
+            Returns None if no unused values were found.
+        """
+        instance = self.build_instance(counter)
+        if self.unique_values is None:
+            self.unique_values = UniqueValues(self.model)
+        for attempt in range(self.max_unique_attempts):
+            clashes = self.unique_values.clashes(instance)
+            if not clashes:
+                self.unique_values.add(instance)
+                return instance
+            # Leaving a field blank would keep the value that clashed
+            for field in clashes:
+                self.generate_value(field, instance, counter, allow_blank=False)
+        logging.debug("No unique values found for %s" % self.model._meta.object_name)
+        return None
+
+    def populate_many_to_many(self, pks=None):
+        """ Many to Many fields are special, they need to be added after 
+            saving. The connections are written directly to the intermediate
+            table in bulk, choosing the related objects from a pool of keys.
+            The primary keys of the objects to connect can be given, if they
+            were created by another process.
+        """
+        if pks is None:
+            pks = self.pks
+        begin_task('many_to_many', self.model)
+        for field in self.model._meta.many_to_many:
+            through = field.rel.through
+            source = through._meta.get_field(field.m2m_field_name()).attname
+            target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+            pool = reference_pools.get_pool(field.rel.to, 'pk')
+            rng = random_for(field)
+
+            # Intermediate models given with through= can have other 
+            # required fields, which are generated as for any other model.
+            if through._meta.auto_created:
+                build = lambda: through()
+            elif through in registry:
+                build = registry[through].build_instance
+            else:
+                build = Populator(through).build_instance
+
+            chunk_size = self.chunk_size or 1000
+            links = []
+            for pk in pks:
+                number = rng.randint(0, min(self.max_many_to_many_connections, len(pool.values)))
+                for value in rng.sample(pool.values, number):
+                    link = build()
+                    setattr(link, source, pk)
+                    setattr(link, target, value)
+                    links.append(link)
+                if len(links) >= chunk_size:
+                    transaction.commit_on_success(bulk_insert)(through, links, set_pks=False)
+                    links = []
+            transaction.commit_on_success(bulk_insert)(through, links, set_pks=False)
+
+
+class UniqueValues(object):
+    """ The values used by a model's unique fields and unique_together sets,
+        loaded from the database once and added to as instances are built,
+        so that clashes are found without querying the database.
+    """
+    def __init__(self, model):
+        opts = model._meta
+        self.constraints = [(f,) for f in opts.fields if f.unique and not f.primary_key]
+        self.constraints.extend([tuple([opts.get_field(name) for name in names])
+                                        for names in opts.unique_together])
+        self.used = {}
+        for fields in self.constraints:
+            values = model._default_manager.values_list(*[f.attname for f in fields])
+            self.used[fields] = set([tuple(v) for v in values.iterator()])
+
+    def values(self, instance, fields):
+        return tuple([getattr(instance, f.attname) for f in fields])
+
+    def clashes(self, instance):
+        """ Returns the fields of each constraint whose values have been
+            used already. Values including None never clash.
+        """
+        clashes = set()
+        for fields in self.constraints:
+            values = self.values(instance, fields)
+            if None not in values and values in self.used[fields]:
+                clashes.update(fields)
+        return clashes
+
+    def add(self, instance):
+        for fields in self.constraints:
+            values = self.values(instance, fields)
+            if None not in values:
+                self.used[fields].add(values)
+
+def begin_task(name, model):
+    """ Starts a new task, with its own random number streams. Seeded runs
+        also reload the reference pools, so that the values chosen don't
+        depend on which tasks were run before in this process.
+    """
+    random_streams.begin(name, model._meta.app_label, model._meta.object_name)
+    if random_streams.seed_value is not None:
+        reference_pools.clear()
+
+# How often blankable fields are left blank
+BLANK_CHOICES = (True, False, False, False)
+
+def generate_choice(field, instance, counter):
+    return random_for(field).choice(field.choices)[0]
+
 registry = PopulateCache()
@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+
+""" Ordering and parallel running of populators.
+    Models are grouped into stages, so that the models a model references
+    with a foreign key are populated in an earlier stage. The models in a
+    stage are independent of each other and can be populated at the same
+    time, each in its own process (with its own database connection).
+"""
+
+import logging
+from multiprocessing import Pool
+from django.db import connections, router
+from django.db.models import get_model
+
+
+def dependency_stages(models):
+    """ Returns the given models as a list of stages (lists of models), each
+        model coming after the models it references by foreign key (or
+        inherits from). References to models that are not being populated
+        and to the model itself are ignored. Models that reference each
+        other in a cycle are put in a stage of their own, in the order they
+        were given (see independent()).
+    """
+    remaining = list(models)
+    dependencies = dict([(model, references(model, remaining)) for model in remaining])
+
+    done = set()
+    stages = []
+    while remaining:
+        stage = [m for m in remaining if dependencies[m] <= done]
+        if not stage:
+            stage = find_cycle(remaining, dependencies, done)
+            logging.warning("Models have circular references, populating in given order: %s"
+                                % ", ".join([m._meta.object_name for m in stage]))
+        stages.append(stage)
+        done.update(stage)
+        remaining = [m for m in remaining if m not in done]
+    return stages
+
+
+def references(model, models):
+    " The other models of the given ones, which the model references. "
+    return set([f.rel.to for f in model._meta.fields
+                    if f.rel and f.rel.to in models and f.rel.to is not model])
+
+
+def find_cycle(remaining, dependencies, done):
+    """ Returns the first group of models (in the given order) which
+        reference each other in a cycle, and otherwise only reference
+        models that are done.
+    """
+    reachable = dict([(m, all_dependencies(m, dependencies) - done) for m in remaining])
+    for model in remaining:
+        if model not in reachable[model]:
+            continue
+        group = [m for m in remaining
+                    if m is model or (m in reachable[model] and model in reachable[m])]
+        outside = set()
+        for m in group:
+            outside.update(dependencies[m])
+        if outside - done <= set(group):
+            return group
+    return remaining
+
+
+def all_dependencies(model, dependencies):
+    " The models the given model depends on, directly or indirectly. "
+    found = set()
+    todo = list(dependencies[model])
+    while todo:
+        dependency = todo.pop()
+        if dependency not in found:
+            found.add(dependency)
+            todo.extend(dependencies[dependency])
+    return found
+
+
+def independent(stage):
+    """ Whether none of the models in the stage reference each other, so
+        that they can be populated at the same time. Models in a reference
+        cycle have to be populated one after the other.
+    """
+    for model in stage:
+        if references(model, stage):
+            return False
+    return True
+
+
+def supports_parallel(models):
+    """ SQLite databases can't be written to by more than one process at a
+        time, so models stored in one can't be populated in parallel.
+    """
+    for model in models:
+        connection = connections[router.db_for_write(model)]
+        if 'sqlite3' in connection.settings_dict['ENGINE']:
+            return False
+    return True
+
+
+def run_parallel(function, populators, processes, arguments=None):
+    """ Calls function(populator, argument) for each of the given populators,
+        in a pool of processes, returning a dict of the results per model.
+    """
+    models = populators.keys()
+    arguments = arguments or {}
+    tasks = [(model_key(model), arguments.get(model)) for model in models]
+
+    # Forked processes must not share the open connections, they will
+    # each open their own when they need it.
+    close_connections()
+    pool = Pool(processes)
+    try:
+        results = pool.map(function, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(models, results))
+
+
+def close_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+def model_key(model):
+    " A picklable reference to the given model. "
+    return (model._meta.app_label, model._meta.object_name)
+
+
+def populate_task(task):
+    """ Populates a model in a worker process, returning the primary keys
+        of the created objects.
+    """
+    from rollyourown.populate import get_populator
+    key, argument = task
+    populator = get_populator(get_model(*key))
+    populator.populate()
+    return populator.pks
+
+
+def populate_many_to_many_task(task):
+    " Populates the many to many fields of a model in a worker process. "
+    from rollyourown.populate import get_populator
+    key, pks = task
+    get_populator(get_model(*key)).populate_many_to_many(pks)
@@ -0,0 +1,171 @@
+# -*- coding: UTF-8 -*-
+
+""" Snapshots of populated tables, which can be loaded much faster than
+    the data can be generated again.
+    A snapshot is a JSON lines file (gzipped if the filename ends in .gz).
+    Each table starts with a header line giving the model and its columns,
+    followed by one line per row, with the values in a list:
+
+        {"model": "shop.product", "columns": ["id", "name", "price"]}
+        [1, "Lorem Ipsum", "12.50"]
+        [2, "Dolor", "3.00"]
+"""
+
+import gzip
+from StringIO import StringIO
+from django.utils import simplejson
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.db.models import get_model
+
+from rollyourown.populate.bulk import insert_rows, mark_dirty
+from rollyourown.populate.data import reference_pools
+
+
+class SnapshotError(Exception): pass
+
+
+def open_snapshot(filename, mode='r'):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 'b')
+    return open(filename, mode + 'b')
+
+
+def snapshot_models(models):
+    """ Returns the tables to be saved for the given models, in an order
+        that can be loaded: parent models before their children, and the
+        intermediate tables of many to many fields at the end.
+    """
+    ordered = []
+    def add(model):
+        for parent in model._meta.parents:
+            add(parent)
+        if model not in ordered:
+            ordered.append(model)
+    for model in models:
+        add(model)
+    for model in list(ordered):
+        for field in model._meta.many_to_many:
+            through = field.rel.through
+            if through._meta.auto_created and through not in ordered:
+                ordered.append(through)
+    return ordered
+
+
+def dump(models, filename):
+    """ Writes the rows of the given models' tables to the given file, one
+        row at a time. Returns the number of rows written.
+    """
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    count = 0
+    out = open_snapshot(filename, 'w')
+    try:
+        for model in snapshot_models(models):
+            fields = model._meta.local_fields
+            opts = model._meta
+            out.write(encoder.encode({'model': "%s.%s" % (opts.app_label, opts.object_name.lower()),
+                                      'columns': [f.column for f in fields]}) + "\n")
+            rows = model._default_manager.order_by('pk').values_list(*[f.attname for f in fields])
+            for row in rows.iterator():
+                out.write(encoder.encode(row) + "\n")
+                count += 1
+    finally:
+        out.close()
+    return count
+
+
+def load(filename, chunk_size=5000):
+    """ Inserts the rows in the given file as it is read, one transaction
+        per chunk of rows. Returns the number of rows loaded for each model.
+    """
+    counts = {}
+    model = None
+    rows = []
+    snapshot = open_snapshot(filename)
+    try:
+        for line_number, line in enumerate(snapshot):
+            data = simplejson.loads(line)
+            if isinstance(data, dict):
+                if model is not None:
+                    load_rows(model, rows)
+                    finish_table(model)
+                model = get_model(*data['model'].split(".", 1))
+                if model is None:
+                    raise SnapshotError("Unknown model %s on line %d of %s"
+                                        % (data['model'], line_number + 1, filename))
+                counts[model] = 0
+                rows = []
+            elif model is None:
+                raise SnapshotError("Row before any table header on line %d of %s"
+                                        % (line_number + 1, filename))
+            else:
+                rows.append(data)
+                counts[model] += 1
+                if len(rows) >= chunk_size:
+                    load_rows(model, rows)
+                    rows = []
+        if model is not None:
+            load_rows(model, rows)
+            finish_table(model)
+    finally:
+        snapshot.close()
+    return counts
+
+
+def load_rows(model, rows):
+    """ Inserts the given rows (lists of values in the order of the model's
+        local fields) in a single transaction. PostgreSQL tables are filled
+        with COPY, other databases with executemany().
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    fields = model._meta.local_fields
+    columns = [f.column for f in fields]
+    rows = [[prep_value(f, value, connection) for f, value in zip(fields, row)] for row in rows]
+    if 'postgresql_psycopg2' in connection.settings_dict['ENGINE']:
+        transaction.commit_on_success(copy_rows)(connection, model._meta.db_table, columns, rows)
+    else:
+        transaction.commit_on_success(insert_rows)(connection, model._meta.db_table, columns, rows)
+
+
+def prep_value(field, value, connection):
+    if value is None:
+        return None
+    return field.get_db_prep_save(field.to_python(value), connection=connection)
+
+
+def finish_table(model):
+    """ The primary keys were given when loading, so the sequences need to
+        catch up, and any reference pools need reloading.
+    """
+    connection = connections[router.db_for_write(model)]
+    sql_list = connection.ops.sequence_reset_sql(no_style(), [model])
+    if sql_list:
+        def reset():
+            cursor = connection.cursor()
+            for sql in sql_list:
+                cursor.execute(sql)
+            mark_dirty(connection.alias)
+        transaction.commit_on_success(reset)()
+    reference_pools.reset(model)
+
+
+def copy_rows(connection, table, columns, rows):
+    " Inserts the given rows with PostgreSQL's COPY. "
+    data = StringIO()
+    for row in rows:
+        data.write("\t".join([copy_value(value) for value in row]) + "\n")
+    data.seek(0)
+    qn = connection.ops.quote_name
+    connection.cursor().copy_from(data, qn(table), columns=[qn(c) for c in columns])
+    mark_dirty(connection.alias)
+
+
+def copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
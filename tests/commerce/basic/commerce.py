@@ -2,8 +2,11 @@
 # -*- coding: UTF-8 -*-
 
 from rollyourown import commerce
+from rollyourown.commerce.utils import Money
+from rollyourown.commerce.tax import load_tax_rates
+from rollyourown.commerce.promotions import PromotionIndex, PercentOff, TieredPercentOff, BuyXGetY
 from basic import models
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_EVEN
 from forms import DeliveryForm
 
 
@@ -64,6 +67,76 @@ class OrderSummary(commerce.Summary):
     def get_amount_delivery(self, instance):
         return "15.00"
 
+class MarketplaceSummary(commerce.Summary):
+    items    = commerce.Items(item_amount_from="model.amount", currency="model.currency")
+    fees     = commerce.Items(item_amount_from="model.amount", currency="GBP")
+    delivery = commerce.Extra(amount="5.00")
+    total    = commerce.Total()
+
+    class Meta:
+        currency = "EUR"
+        exchange_rates = commerce.ExchangeRates({'EUR': 1, 'USD': "1.25", 'GBP': "0.8"})
+
+class CompactCartSummary(commerce.Summary):
+    items    = commerce.Items(attribute="items", item_amount_from="model.item_price")
+    discount = commerce.Extra(amount="-12.23")
+    tax      = commerce.Extra(amount="1.005", included=True)
+    total    = commerce.Total()
+    pretax   = commerce.Total('items', '-tax')
+    cached_total = commerce.Total('items', model_cache="cached_total")
+
+    class Meta:
+        locale = "en-AU"
+        currency = "EUR"
+        amount_class = Money
+
+class RoundedSummary(commerce.Summary):
+    items       = commerce.Items(item_amount_from="model.amount")
+    fee         = commerce.Extra(amount="0.125")
+    total       = commerce.Total()
+    items_total = commerce.Total('items')
+    line_total  = commerce.Total('items', rounding=commerce.Rounding(per_line=True))
+    even_total  = commerce.Total('items', rounding=commerce.Rounding(per_line=True, mode=ROUND_HALF_EVEN))
+    yen_total   = commerce.Total('items', '-fee', rounding=commerce.Rounding(places=0))
+
+    class Meta:
+        currency = "EUR"
+        rounding = commerce.Rounding()
+
+class TaxedCartSummary(commerce.Summary):
+    items     = commerce.Items(attribute="items", item_amount_from="model.item_price")
+    gst       = commerce.Tax("GST", included=True)
+    vat       = commerce.Tax(rates={'A': "0.2", 'B': 0}, rate_from="self.get_vat_class",
+                                cache_tax_as="VAT")
+    total     = commerce.Total('items', 'gst')
+    total_net = commerce.Total('items', '-gst')
+    total_vat = commerce.Total('items', 'vat')
+
+    class Meta:
+        currency = "AUD"
+
+    def get_gst_rates(self, instance):
+        return load_tax_rates(models.Product.objects.all())
+
+    def get_vat_class(self, item):
+        return item.quantity > 1 and 'A' or 'B'
+
+PROMOTIONS = PromotionIndex([
+    PercentOff(10, categories=['books'], cap=2, name="Books"),
+    BuyXGetY(2, 1, products=['socks'], name="Socks"),
+    TieredPercentOff([(5, 5), (10, 10)], name="Bulk"),
+    PercentOff(50, products=['hat'], name="Hats"),
+    PercentOff(10, products=['shirt'], categories=['clothes'], name="Clothes"),
+    ])
+
+class PromotedSummary(commerce.Summary):
+    items      = commerce.Items(item_amount_from="model.amount")
+    promotions = commerce.Promotions(product_from="model.product", category_from="model.category")
+    total      = commerce.Total()
+
+    def get_promotions_rules(self, instance):
+        return PROMOTIONS
+
 class SelfMetaSummary(commerce.Summary):
     class Meta:
         locale = "self.get_locale"
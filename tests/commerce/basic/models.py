@@ -1,10 +1,12 @@
 from django.db import models
 from datetime import datetime
 from decimal import Decimal
+from rollyourown.commerce.utils import FriendlyIDField, FriendlyIDManager
 
 class Product(models.Model):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    tax_rate = models.DecimalField(max_digits=5, decimal_places=4, default="0.1")
 
 class Cart(models.Model):
     items        = models.ManyToManyField(Product, through="CartItem")
@@ -45,6 +47,9 @@ class Order(models.Model):
     items         = models.ManyToManyField(Product, through="OrderItem")
     vouchers      = models.ManyToManyField('Voucher')
     date_created  = models.DateTimeField(default=datetime.now)
+    friendly_id   = FriendlyIDField()
+
+    objects = FriendlyIDManager()
 
 class OrderItem(models.Model):
     product = models.ForeignKey(Product)
@@ -58,3 +63,16 @@ class Voucher(models.Model):
 
 class Payment(models.Model):
     pass
+
+# Models that reference each other in a cycle, and one that depends on them
+class Supplier(models.Model):
+    warehouse = models.ForeignKey('Warehouse', null=True, blank=True, related_name='suppliers')
+
+class Warehouse(models.Model):
+    supplier = models.ForeignKey(Supplier, null=True, blank=True, related_name='warehouses')
+
+class Shipment(models.Model):
+    warehouse = models.ForeignKey(Warehouse)
+
+class Download(models.Model):
+    file = models.FileField(upload_to='downloads')
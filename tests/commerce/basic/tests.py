@@ -5,12 +5,50 @@ unittest). These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
-from django.test import TestCase
-from models import Cart, Order, Product, CartItem, Voucher
-from commerce import CartSummary, OrderSummary, SelfMetaSummary, ModelMetaSummary
+from django.test import TestCase, TransactionTestCase
+from django.conf import settings
+from django.db import connection, reset_queries, transaction
+from models import Cart, Order, OrderItem, Product, CartItem, Voucher
+from models import Supplier, Warehouse, Shipment, Download
+from commerce import CartSummary, OrderSummary, SelfMetaSummary, ModelMetaSummary, MarketplaceSummary
+from commerce import CompactCartSummary, RoundedSummary, TaxedCartSummary, PromotedSummary
+from rollyourown.commerce import Tracer, json_summary, stream_json_summaries
+from rollyourown.commerce import ExchangeRates, FileExchangeRates
+from rollyourown.commerce.currency import ExchangeRateError
+from rollyourown.commerce.promotions import PromotionIndex, PercentOff, Rule, BuyXGetY
+from django.utils import simplejson
+from rollyourown.commerce.utils import FriendlyID, friendly_id, Money, FormattedDecimal
+from rollyourown.commerce.utils.money import MoneyContext, CurrencyMismatchError
 from decimal import Decimal
+import doctest
+import os
+import shutil
+import tempfile
 from django.db.models import Sum
 from django.utils.datastructures import SortedDict
+from rollyourown.populate import Populator, populate_models, dependency_stages
+from rollyourown.populate.scheduling import independent
+from rollyourown.populate.bulk import bulk_insert
+from rollyourown.populate.registration import UniqueValues
+from rollyourown.populate import snapshot
+from rollyourown.populate.data import reference_pools, ReferencePool, random_streams
+from rollyourown.populate.data import FileCorpus, file_corpora
+from rollyourown.populate.data import generate_chars, lorem_text, pooled_text
+from django.contrib.webdesign import lorem_ipsum
+import random
+from django.core.files.storage import FileSystemStorage
+
+
+def run_queries(function, *args, **kwargs):
+    """ Returns the SQL of the queries run by the given function. """
+    old_debug = settings.DEBUG
+    settings.DEBUG = True
+    reset_queries()
+    try:
+        function(*args, **kwargs)
+        return [q['sql'] for q in connection.queries]
+    finally:
+        settings.DEBUG = old_debug
 
 
 class Extras(TestCase):
@@ -108,6 +146,25 @@ class Extras(TestCase):
 
         form = self.cart_summary.form(data)
         assert form.errors, "No error raised for form"
+        assert not form.is_valid()
+        self.assertEqual(form.errors.keys(), ['delivery'])
+        self.assertEqual(form.errors['delivery'].keys(), ['address'])
+        self.assertRaises(AttributeError, form.errors.update, {'x': 1})
+        self.assertEqual(form.errors, form.errors)
+
+    def test_editable_fail_fast(self):
+        """ Tests that validation stops at the first invalid element. """
+        data = {'items-TOTAL_FORMS': 0,
+                'items-INITIAL_FORMS': 0,
+                'items-MAX_NUM_FORMS': '',
+                # 'delivery-address' missing
+                'discount_code': 'C' * 20,
+                }
+
+        form = self.cart_summary.form(data)
+        self.assertEqual(sorted(form.errors.keys()), ['delivery', 'discount_code'])
+        form = self.cart_summary.form(data, fail_fast=True)
+        self.assertEqual(form.errors.keys(), ['discount_code'])
 
 class Items(TestCase):
 
@@ -149,6 +206,39 @@ class Items(TestCase):
         total_two = self.cart_summary.vouchers_total
         self.assertEqual(total_one, total_two)
 
+    def test_editable_bulk_save(self):
+        """ Tests that only changed rows are saved and cached totals updated. """
+        data = {'items-TOTAL_FORMS': 2,
+                'items-INITIAL_FORMS': 2,
+                'items-MAX_NUM_FORMS': '',
+                'items-0-id': self.item_1.pk,
+                'items-0-product': self.product_1.pk,
+                'items-0-quantity': 3,
+                'items-1-id': self.item_2.pk,
+                'items-1-product': self.product_2.pk,
+                'items-1-quantity': 1,
+                'delivery-address': '123 Main St',
+                'discount_code': 'CDE',
+                }
+        form = self.cart_summary.form(data)
+        assert form.is_valid(), str(form.errors)
+        queries = run_queries(form.save, bulk=True)
+
+        # Only the changed row is updated. The cart is saved once by the
+        # summary, and once by the delivery form (a plain form, which saves
+        # the instance itself).
+        qn = connection.ops.quote_name
+        item_updates = [q for q in queries if q.startswith("UPDATE %s " % qn(CartItem._meta.db_table))]
+        cart_updates = [q for q in queries if q.startswith("UPDATE %s " % qn(Cart._meta.db_table))]
+        self.assertEqual(len(item_updates), 1)
+        self.assertEqual(len(cart_updates), 2)
+
+        self.assertEqual(CartItem.objects.get(pk=self.item_1.pk).quantity, 3)
+        self.assertEqual(CartItem.objects.get(pk=self.item_2.pk).quantity, 1)
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual(cart.discount_code, 'CDE')
+        self.assertEqual(cart.cached_total, Decimal("11.25"))
+
     def test_editable_table(self):
         form = self.cart_summary.form()
         self.assertEqual(form.as_table(), "")
@@ -343,6 +433,624 @@ Delivery      15.00
         
 
 
+class Currencies(TestCase):
+    def setUp(self):
+        class FakeModel(object):
+            pass
+        class FakeItem(object):
+            def __init__(self, amount, currency):
+                self.amount = amount
+                self.currency = currency
+        self.fake_model = FakeModel()
+        self.fake_model.items = [FakeItem("10.00", "USD"), FakeItem("5.00", "EUR"),
+                                 FakeItem("0.01", "USD")]
+        self.fake_model.fees = [FakeItem("1.00", None)]
+
+    def test_conversion(self):
+        summary = MarketplaceSummary(self.fake_model)
+        self.assertEqual([i.AMOUNT for i in summary.items], 
+                         [Decimal("8.00"), Decimal("5.00"), Decimal("0.01")])
+        self.assertEqual(summary.fees[0].AMOUNT, Decimal("1.25"))
+        self.assertEqual(summary.total, Decimal("19.26"))
+
+    def test_missing_rate(self):
+        self.fake_model.items[0].currency = "AUD"
+        self.assertRaises(ExchangeRateError, getattr, MarketplaceSummary(self.fake_model), 'total')
+
+    def test_rate_table(self):
+        rates = ExchangeRates({'EUR': 1, 'USD': "1.5"}, places=0)
+        self.assertEqual(rates.convert_column(["3", "2", 7], ["EUR", "USD", "EUR"], "USD"),
+                         [Decimal("4"), "2", Decimal("10")])
+        self.assertEqual(rates.convert(Decimal("3.00"), "USD", "EUR"), Decimal("2"))
+
+    def test_file_rates(self):
+        import tempfile, os
+        handle, path = tempfile.mkstemp(".json")
+        try:
+            os.write(handle, '{"EUR": 1, "USD": 1.25}')
+            os.close(handle)
+            rates = FileExchangeRates(path, ttl=60)
+            self.assertEqual(rates.get_factor("EUR", "USD"), Decimal("1.25"))
+            open(path, "w").write('{"EUR": 1, "USD": 2}')
+            self.assertEqual(rates.get_factor("EUR", "USD"), Decimal("1.25"))
+            rates.ttl = 0
+            rates._loaded -= 1
+            self.assertEqual(rates.get_factor("EUR", "USD"), Decimal("2"))
+        finally:
+            os.remove(path)
+
+
+class Rounding(TestCase):
+    def setUp(self):
+        class FakeModel(object):
+            pass
+        class FakeItem(object):
+            def __init__(self, amount):
+                self.amount = amount
+        self.fake_model = FakeModel()
+        self.fake_model.items = [FakeItem("0.005"), FakeItem("0.005"), FakeItem(Decimal("0.015"))]
+
+    def test_policies(self):
+        summary = RoundedSummary(self.fake_model)
+        self.assertEqual(summary.items_total.as_tuple(), Decimal("0.03").as_tuple())
+        self.assertEqual(summary.total, Decimal("0.15"))
+        self.assertEqual(summary.line_total, Decimal("0.04"))
+        self.assertEqual(summary.even_total, Decimal("0.02"))
+        self.assertEqual(summary.yen_total, Decimal("0"))
+
+    def test_no_policy(self):
+        summary = OrderSummary(self.fake_model)
+        self.assertEqual(summary.total.as_tuple(), Decimal("15.025").as_tuple())
+
+
+class Taxes(TestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.product_1 = Product.objects.create(price=Decimal("0.55"))
+        self.product_2 = Product.objects.create(price=Decimal("11.00"), tax_rate=0)
+        self.item_1    = CartItem.objects.create(cart=self.cart, product=self.product_1, quantity=3)
+        self.item_2    = CartItem.objects.create(cart=self.cart, product=self.product_1)
+        self.item_3    = CartItem.objects.create(cart=self.cart, product=self.product_2)
+
+    def test_tax(self):
+        summary = TaxedCartSummary(self.cart)
+        self.assertEqual(summary.gst.amount, Decimal("0.20"))
+        self.assertEqual([i.TAX for i in summary.items], 
+                         [Decimal("0.15"), Decimal("0.05"), Decimal("0.00")])
+        self.assertEqual(summary.total, Decimal("13.20"))
+        self.assertEqual(summary.total_net, Decimal("13.00"))
+        self.assertEqual(summary.vat.amount, Decimal("0.33"))
+        self.assertEqual([i.VAT for i in summary.items], 
+                         [Decimal("0.33"), Decimal("0.00"), Decimal("0.00")])
+        self.assertEqual(summary.total_vat, Decimal("13.53"))
+
+    def test_missing_rate(self):
+        summary = TaxedCartSummary(self.cart)
+        summary.get_vat_class = lambda item: 'C'
+        self.assertRaises(KeyError, getattr, summary.vat, 'amount')
+
+
+class Promotions(TestCase):
+    def setUp(self):
+        class FakeModel(object):
+            pass
+        class FakeItem(object):
+            def __init__(self, product, category, quantity, amount):
+                self.product = product
+                self.category = category
+                self.quantity = quantity
+                self.amount = amount
+        self.fake_model = FakeModel()
+        self.fake_model.items = [FakeItem('socks', 'clothes', 3, "9.00"),
+                                 FakeItem('shirt', 'clothes', 1, "20.00"),
+                                 FakeItem('book', 'books', 2, "30.00")]
+
+    def test_promotions(self):
+        summary = PromotedSummary(self.fake_model)
+        self.assertEqual([(r.name, d) for r, d in summary.promotions.applied],
+                         [("Books", Decimal("2.00")), ("Socks", Decimal("3.00")),
+                          ("Bulk", Decimal("2.95")), ("Clothes", Decimal("2.90"))])
+        self.assertEqual(summary.promotions.amount, Decimal("-10.85"))
+        self.assertEqual(summary.total, Decimal("48.15"))
+
+    def test_stacked_discounts_capped(self):
+        """ Checks that stacked rules never discount more than a line. """
+        index = PromotionIndex([PercentOff(80, products=['hat'], name="Big"),
+                                PercentOff(50, products=['hat'], name="Half"),
+                                PercentOff(10, name="Everything")])
+        lines = [('hat', None, Decimal("10.00"), 1, Decimal("10.00")),
+                 ('scarf', None, Decimal("5.00"), 1, Decimal("5.00"))]
+        self.assertEqual([(r.name, d) for r, d in index.evaluate(lines)],
+                         [("Big", Decimal("8.00")), ("Half", Decimal("2.00")),
+                          ("Everything", Decimal("1.50"))])
+
+    def test_buy_x_get_y_whole_groups(self):
+        """ Checks that only whole groups of items get free units. """
+        rule = BuyXGetY(2, 1, products=['socks'])
+        lines = [(Decimal("3.00"), Decimal("5"), Decimal("15.00"))]
+        self.assertEqual(rule.discount(lines), Decimal("3.00"))
+        lines = [(Decimal("3.00"), 5, Decimal("15.00"))]
+        self.assertEqual(rule.discount(lines), Decimal("3.00"))
+
+    def test_rule_default(self):
+        self.assertEqual(Rule(products=['hat']).discount([(Decimal(1), 1, Decimal(1))]), 0)
+
+    def test_no_promotions(self):
+        self.fake_model.items = self.fake_model.items[2:]
+        self.fake_model.items[0].category = None
+        summary = PromotedSummary(self.fake_model)
+        self.assertEqual(summary.promotions.applied, [])
+        self.assertEqual(summary.total, Decimal("30.00"))
+
+
+class CompactAmounts(TestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.product_1 = Product.objects.create(price=Decimal("0.01"))
+        self.product_2 = Product.objects.create(price=Decimal("11.22"))
+        self.item_1    = CartItem.objects.create(cart=self.cart, product=self.product_1, quantity=7)
+        self.item_2    = CartItem.objects.create(cart=self.cart, product=self.product_2)
+
+    def test_summary(self):
+        summary = CompactCartSummary(self.cart)
+        self.assertEqual(summary.items[0].AMOUNT.minor, 7)
+        self.assertEqual(summary.tax.amount, Decimal("1.00"))
+        self.assertEqual(summary.total, Decimal("-0.94"))
+        self.assertEqual(summary.pretax, Decimal("10.29"))
+        self.assertEqual(summary.cached_total, Decimal("11.29"))
+        self.assertEqual(self.cart.cached_total, Decimal("11.29"))
+        assert isinstance(summary.total, Money)
+        assert summary.total.context is summary.items[1].AMOUNT.context
+        self.assertEqual(unicode(summary.total), u"-0.94")
+        self.assertEqual(simplejson.loads(json_summary(summary, ['total'])), {'total': "-0.94"})
+
+    def test_arithmetic(self):
+        a = Money("1.25")
+        self.assertEqual(a + 1, Decimal("2.25"))
+        self.assertEqual(Decimal("0.75") + a, Money(2))
+        self.assertEqual(sum([a, a, a]), Decimal("3.75"))
+        self.assertEqual(1 - a, Decimal("-0.25"))
+        self.assertEqual(a * 3, Decimal("3.75"))
+        self.assertEqual(a * Decimal("0.5"), Decimal("0.62"))
+        assert a > 1 and a < Decimal("1.26") and -a < 0
+        self.assertEqual(Money("0.005"), Decimal("0.00"))
+        self.assertEqual("%.2f" % a, "1.25")
+
+    def test_currency_mismatch(self):
+        euros = Money("1.00", MoneyContext.get_context(currency="EUR"))
+        dollars = Money("1.00", MoneyContext.get_context(currency="USD"))
+        self.assertRaises(CurrencyMismatchError, lambda: euros + dollars)
+        self.assertRaises(CurrencyMismatchError, lambda: euros - dollars)
+        self.assertNotEqual(euros, dollars)
+        # Amounts without a currency take the currency of the other
+        self.assertEqual(euros + Money("1.00"), Decimal("2.00"))
+
+    def test_conversion(self):
+        summary = CartSummary(self.cart)
+        formatted = summary.items_total
+        money = Money.from_formatted_decimal(formatted)
+        self.assertEqual(money.minor, 1129)
+        converted = money.to_formatted_decimal()
+        assert isinstance(converted, FormattedDecimal)
+        self.assertEqual(converted, formatted)
+        self.assertEqual(converted.HTML, formatted.HTML)
+        self.assertEqual(money.html, formatted.html)
+
+
+class Serialization(TestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.product_1 = Product.objects.create(price=Decimal("0.01"))
+        self.item_1    = CartItem.objects.create(cart=self.cart, product=self.product_1, quantity=7)
+
+    def test_json_summary(self):
+        data = simplejson.loads(json_summary(CartSummary(self.cart)))
+        self.assertEqual(data['items'], {str(self.item_1.pk): "0.07"})
+        self.assertEqual(data['discount'], "-12.23")
+        self.assertEqual(data['total'], "7.87")
+        self.assertEqual(data['custom_total'], 42)
+        self.assertEqual(len(data), len(CartSummary._meta.elements))
+
+    def test_json_summary_fields(self):
+        data = simplejson.loads(json_summary(CartSummary(self.cart), ['tax', 'total']))
+        self.assertEqual(data, {'tax': "10.03", 'total': "7.87"})
+        self.assertEqual(json_summary(CartSummary(self.cart), []), "{}")
+
+    def test_json_summary_totals_once(self):
+        """ Checks that each total is only calculated once per summary. """
+        reports = []
+        tracer = Tracer(sinks=[reports.append])
+        summary = CartSummary(self.cart, tracer=tracer)
+        first = json_summary(summary)
+        self.assertEqual(json_summary(summary), first)
+        tracer.emit()
+
+        records = dict(((r['kind'], r['name']), r) for r in reports[0])
+        for name in CartSummary._meta.totals:
+            self.assertEqual(records[('total', name)]['calls'], 1)
+
+    def test_stream_json_summaries(self):
+        summaries = [CartSummary(self.cart), CartSummary(self.cart)]
+        data = simplejson.loads("".join(stream_json_summaries(summaries, ['total'])))
+        self.assertEqual(data, [{'total': "7.87"}, {'total': "7.87"}])
+        self.assertEqual("".join(stream_json_summaries([])), "[]")
+
+
+class Tracing(TestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.product_1 = Product.objects.create(price=Decimal("0.01"))
+        self.item_1    = CartItem.objects.create(cart=self.cart, product=self.product_1)
+        self.item_2    = CartItem.objects.create(cart=self.cart, product=self.product_1)
+
+    def test_report(self):
+        """ Checks that elements are timed and cache hits recorded. """
+        reports = []
+        tracer = Tracer(sinks=[reports.append])
+        cart_summary = CartSummary(self.cart, tracer=tracer)
+        cart_summary.items_total
+        cart_summary.items_total
+        tracer.emit()
+
+        records = dict(((r['kind'], r['name']), r) for r in reports[0])
+        self.assertEqual(records[('total', 'items_total')]['calls'], 2)
+        self.assertEqual(records[('items', 'items')]['calls'], 1)
+        self.assertEqual(records[('items', 'items')]['cache_hits'], 1)
+        self.assertEqual(records[('item_amount', 'items')]['calls'], 2)
+
+    def test_extra_not_cached(self):
+        """ Extra amounts are resolved each time, so are never cache hits. """
+        tracer = Tracer()
+        cart_summary = CartSummary(self.cart, tracer=tracer)
+        cart_summary.delivery.amount
+        cart_summary.delivery.amount
+        record = dict(((r['kind'], r['name']), r) for r in tracer.report())[('extra', 'delivery')]
+        self.assertEqual(record['calls'], 2)
+        self.assertEqual(record['cache_hits'], 0)
+
+
+class FriendlyIDs(TestCase):
+    def test_usage(self):
+        """ Checks the example in the module's docstring. """
+        failures, tests = doctest.testmod(friendly_id)
+        self.assertEqual(failures, 0)
+        assert tests
+
+    def test_decode(self):
+        fi = FriendlyID()
+        for num in (0, 1, 2, 26**5-1, 26**5, 10**12):
+            self.assertEqual(fi.decode(fi.encode(num)), num)
+        self.assertEqual(fi.decode("KSR6"), None)
+        self.assertEqual(fi.decode("ksr68"), None)
+
+    def test_decode_string_length(self):
+        fi = FriendlyID(string_length=7)
+        for num in (0, 1, 26**5, 26**7):
+            self.assertEqual(fi.decode(fi.encode(num)), num)
+
+    def test_encode_many(self):
+        numbers = [5, -1, 0, 26**5-1, 26**5, 26**6*25, 10**12] + range(100)
+        for fi in (FriendlyID(), FriendlyID(string_length=7), FriendlyID(minimum_length=2)):
+            self.assertEqual(fi.encode_many(numbers), [fi.encode(n) for n in numbers])
+        self.assertEqual(FriendlyID().encode_many([]), [])
+
+    def test_period(self):
+        """ Checks periods are found from the factorisation of each size. """
+        fi = FriendlyID(valid_chars="3456789A")
+        self.assertEqual([tier[1] for tier in fi.tiers], [151])
+        self.assertEqual(fi.get_period(8**5-1), 151)
+        self.assertEqual(fi.encode(8**5), fi.encode_many([8**5])[0])
+        self.assertEqual([tier[1] for tier in fi.tiers], [151, 8])
+        self.assertRaises(ValueError, FriendlyID, valid_chars="AB")
+
+    def test_verify(self):
+        self.assertEqual(friendly_id.verify(10**40), [])
+        fi = FriendlyID(valid_chars="3456789A")
+        self.assertEqual(friendly_id.verify(8**6, fi, empirical=True, processes=2), [])
+        fi = FriendlyID(valid_chars="3456789A", string_length=7)
+        assert friendly_id.verify(8**6, fi)
+        assert friendly_id.verify(8**6, fi, empirical=True)
+
+    def test_decode_exhaustive(self):
+        """ Checks every code of the minimum length for a small alphabet. """
+        assert friendly_id.test_decode(FriendlyID(valid_chars="3456789A"))
+
+    def test_field(self):
+        orders = [Order.objects.create() for i in range(3)]
+        fi = FriendlyID()
+        self.assertEqual(orders[1].friendly_id, fi.encode(orders[1].pk))
+        self.assertEqual(Order().friendly_id, None)
+        self.assertEqual(Order.objects.get_by_friendly_id(orders[1].friendly_id), orders[1])
+        self.assertRaises(Order.DoesNotExist, Order.objects.get_by_friendly_id, "KSR6")
+        codes = [orders[0].friendly_id, orders[2].friendly_id, "KSR6"]
+        self.assertEqual(set(Order.objects.filter_by_friendly_ids(codes)),
+                            set([orders[0], orders[2]]))
+        self.assertEqual(Order.objects.friendly_ids(),
+                            dict((o.pk, o.friendly_id) for o in orders))
+
+
+class Populate(TransactionTestCase):
+    """ Populating commits its own transactions, so these tests check that
+        the rows are still there after rolling back anything uncommitted.
+    """
+    def setUp(self):
+        reference_pools.clear()
+
+    def tearDown(self):
+        random_streams.seed()
+
+    def test_chunks_committed(self):
+        populator = Populator(Product, instances=50, chunk_size=20)
+        populator.populate()
+        transaction.rollback()
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual(sorted(populator.pks),
+                         list(Product.objects.order_by('pk').values_list('pk', flat=True)))
+        # The chunks' objects are referenced by the models populated later
+        self.assertEqual(sorted(reference_pools.get_pool(Product, 'pk').values), sorted(populator.pks))
+
+    def test_bulk_insert_pks(self):
+        Product.objects.create(name="Existing", price=Decimal("1.00"))
+        products = [Product(name="New %d" % i, price=Decimal(i)) for i in range(3)]
+        transaction.commit_on_success(bulk_insert)(Product, products)
+        transaction.rollback()
+        for product in products:
+            self.assertEqual(Product.objects.get(pk=product.pk).name, product.name)
+
+    def test_references(self):
+        Populator(Product, instances=5).populate()
+        Populator(Cart, instances=3).populate()
+        Populator(CartItem, instances=20, chunk_size=10).populate()
+        transaction.rollback()
+        self.assertEqual(CartItem.objects.count(), 20)
+        products = set(Product.objects.values_list('pk', flat=True))
+        carts = set(Cart.objects.values_list('pk', flat=True))
+        assert set(CartItem.objects.values_list('product_id', flat=True)) <= products
+        assert set(CartItem.objects.values_list('cart_id', flat=True)) <= carts
+
+    def test_reference_pool(self):
+        products = [Product.objects.create(name="P%d" % i, price=1) for i in range(5)]
+        pks = set([p.pk for p in products])
+        pool = ReferencePool(Product, 'pk', max_size=3)
+        self.assertEqual(len(pool.values), 3)
+        assert set(pool.values) <= pks
+        pool.add([100, 101])
+        self.assertEqual(len(pool.values), 3)
+
+        # New objects are added to existing pools, until the model is reset
+        reference_pools.get_pool(Product, 'pk')
+        reference_pools.add(Product, [Product(pk=200)])
+        assert 200 in reference_pools.get_pool(Product, 'pk').values
+        reference_pools.reset(Product)
+        self.assertEqual(set(reference_pools.get_pool(Product, 'pk').values), pks)
+
+    def test_many_to_many(self):
+        Populator(Voucher, instances=5).populate()
+        populator = Populator(Cart, instances=4, max_many_to_many_connections=3)
+        populator.populate()
+        populator.populate_many_to_many()
+        transaction.rollback()
+
+        through = Cart.vouchers.through
+        links = through.objects.all()
+        assert links.count() > 0
+        vouchers = set(Voucher.objects.values_list('pk', flat=True))
+        for cart in Cart.objects.all():
+            voucher_pks = [v.pk for v in cart.vouchers.all()]
+            assert len(voucher_pks) <= 3
+            assert set(voucher_pks) <= vouchers
+
+    def test_many_to_many_through(self):
+        Populator(Product, instances=5).populate()
+        populator = Populator(Order, instances=3, max_many_to_many_connections=5)
+        populator.populate()
+        populator.populate_many_to_many()
+        transaction.rollback()
+
+        assert OrderItem.objects.count() > 0
+        products = set(Product.objects.values_list('pk', flat=True))
+        for item in OrderItem.objects.all():
+            assert item.product_id in products
+            assert item.order_id in populator.pks
+            # The through model's own fields are generated too
+            assert item.quantity is not None
+
+    def test_dependency_stages(self):
+        self.assertEqual(dependency_stages([CartItem, Cart, Product]),
+                         [[Cart, Product], [CartItem]])
+        # Models that aren't being populated are ignored
+        self.assertEqual(dependency_stages([CartItem]), [[CartItem]])
+
+    def test_dependency_cycle(self):
+        # Only the models in the cycle are grouped, not those depending on it
+        stages = dependency_stages([Shipment, Warehouse, Supplier, Product])
+        self.assertEqual(stages, [[Product], [Warehouse, Supplier], [Shipment]])
+        assert independent([Product, Voucher])
+        assert not independent([Warehouse, Supplier])
+
+    def test_populate_models(self):
+        """ Referenced models are populated first, and SQLite databases
+            are populated in a single process even if more are asked for.
+        """
+        populate_models([CartItem, Cart, Product], processes=2)
+        transaction.rollback()
+        self.assertEqual(Product.objects.count(), 10)
+        assert CartItem.objects.filter(product__isnull=False).count() >= 10
+
+    def test_seeded(self):
+        """ Checks that runs with the same seed give the same data. """
+        def run(seed):
+            for model in (CartItem, Cart, Product):
+                model.objects.all().delete()
+            reference_pools.clear()
+            populate_models([CartItem, Cart, Product], seed=seed)
+            return [list(model.objects.order_by('pk').values_list())
+                        for model in (Product, Cart, CartItem)]
+        first = run(42)
+        self.assertEqual(run(42), first)
+        self.assertNotEqual(run(43), first)
+
+    def test_snapshot(self):
+        """ Checks that dumped tables are loaded back as they were. """
+        models = [Product, Voucher, Cart, CartItem, Cart.vouchers.through]
+        populate_models([CartItem, Cart, Product, Voucher], seed=1)
+        before = [list(model.objects.order_by('pk').values_list()) for model in models]
+
+        filename = os.path.join(tempfile.mkdtemp(), 'snapshot.jsonl.gz')
+        try:
+            self.assertEqual(snapshot.dump(models[:4], filename), sum(map(len, before)))
+            for model in reversed(models):
+                model.objects.all().delete()
+            counts = snapshot.load(filename, chunk_size=7)
+            transaction.rollback()
+        finally:
+            shutil.rmtree(os.path.dirname(filename))
+
+        self.assertEqual(counts[Product], len(before[0]))
+        self.assertEqual([list(model.objects.order_by('pk').values_list()) for model in models], before)
+
+    def test_snapshot_without_header(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'snapshot.jsonl')
+        try:
+            f = open(filename, 'w')
+            f.write('[1, "Orphan", "1.00", "0.1"]\n')
+            f.close()
+            self.assertRaises(snapshot.SnapshotError, snapshot.load, filename)
+        finally:
+            shutil.rmtree(os.path.dirname(filename))
+
+    def test_unique_values(self):
+        Through = Cart.vouchers.through
+        cart = Cart.objects.create()
+        voucher = Voucher.objects.create(percent=10)
+        cart.vouchers.add(voucher)
+        unique_values = UniqueValues(Through)
+        self.assertEqual(len(unique_values.constraints), 1)
+
+        # Values already in the database clash, as do the ones added
+        link = Through(cart_id=cart.pk, voucher_id=voucher.pk)
+        self.assertEqual(len(unique_values.clashes(link)), 2)
+        other = Through(cart_id=cart.pk, voucher_id=voucher.pk + 1)
+        self.assertEqual(unique_values.clashes(other), set())
+        unique_values.add(other)
+        self.assertEqual(len(unique_values.clashes(other)), 2)
+        self.assertEqual(unique_values.clashes(Through(cart_id=cart.pk)), set())
+
+    def test_unique_instances(self):
+        Populator(Cart, instances=2).populate()
+        Populator(Voucher, instances=2).populate()
+        populator = Populator(Cart.vouchers.through, instances=10)
+        populator.populate()
+        transaction.rollback()
+        links = list(Cart.vouchers.through.objects.values_list('cart', 'voucher'))
+        self.assertEqual(len(links), len(set(links)))
+        assert len(links) <= 4
+
+    def test_regenerated_not_blank(self):
+        populator = Populator(Cart)
+        field = Cart._meta.get_field('discount_code')
+        for i in range(20):
+            cart = Cart()
+            populator.generate_value(field, cart, i, allow_blank=False)
+            self.assertNotEqual(cart.discount_code, "")
+
+    def test_plan(self):
+        populator = Populator(Cart, data_functions={'address': lambda field, instance, counter: u"%d Main St" % counter})
+        plan = populator.get_plan()
+        assert populator.get_plan() is plan
+        fields = [field.name for field, step in plan]
+        assert 'cached_total' not in fields
+        assert 'id' not in fields
+        assert 'date_created' in fields
+
+        # Data functions are used, and never left blank
+        for i in range(10):
+            self.assertEqual(populator.build_instance(i).address, u"%d Main St" % i)
+
+
+class SampleFiles(TestCase):
+    def setUp(self):
+        file_corpora.clear()
+        self.directory = tempfile.mkdtemp()
+        self.field = Download._meta.get_field('file')
+        self.old_storage = self.field.storage
+        self.field.storage = FileSystemStorage(location=self.directory)
+
+    def tearDown(self):
+        self.field.storage = self.old_storage
+        shutil.rmtree(self.directory)
+        file_corpora.clear()
+
+    def stored_files(self):
+        return os.listdir(os.path.join(self.directory, 'downloads'))
+
+    def test_corpus(self):
+        directory = tempfile.mkdtemp()
+        try:
+            open(os.path.join(directory, 'a.txt'), 'w').write("Alpha")
+            open(os.path.join(directory, '.hidden'), 'w').write("Hidden")
+            corpus = file_corpora.get_corpus(directory)
+            assert file_corpora.get_corpus(directory) is corpus
+            self.assertEqual(corpus.filenames, ['a.txt'])
+            self.assertEqual(corpus.read('a.txt'), "Alpha")
+
+            # The directory is listed and each file read only once
+            open(os.path.join(directory, 'b.txt'), 'w').write("Beta")
+            os.remove(os.path.join(directory, 'a.txt'))
+            self.assertEqual(corpus.filenames, ['a.txt'])
+            self.assertEqual(corpus.read('a.txt'), "Alpha")
+            self.assertEqual(FileCorpus(directory).filenames, ['b.txt'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_share_files(self):
+        populator = Populator(Download, share_files=True)
+        names = [populator.build_instance(i).file.name for i in range(10)]
+        stored = self.stored_files()
+        # Each sample file is stored once, and referenced by every instance
+        self.assertEqual(len(stored), len(set(names)))
+        self.assertEqual(set([os.path.basename(n) for n in names]), set(stored))
+
+    def test_copies(self):
+        populator = Populator(Download)
+        for i in range(10):
+            populator.build_instance(i)
+        self.assertEqual(len(self.stored_files()), 10)
+        # Other populators don't share files because this one did
+        Populator(Download, share_files=True).build_instance()
+        self.assertEqual(len(self.stored_files()), 11)
+
+
+class FastText(TestCase):
+    def test_populator(self):
+        pooled_text.word_list = None
+        Populator(Product).build_instance()
+        assert pooled_text.word_list is None
+        name = Populator(Product, fast_text=True).build_instance().name
+        assert pooled_text.word_list is not None
+        self.assertEqual(len(name.split()), 3)
+
+    def test_shape(self):
+        # Titles have the same number of words, from the same vocabulary
+        field = Product._meta.get_field('name')
+        words = set([w.title() for w in lorem_ipsum.WORDS])
+        for fast_text in (False, True):
+            for i in range(20):
+                title = generate_chars(field, None, i, fast_text=fast_text)
+                self.assertEqual(len(title.split()), 3)
+                assert set(title.split()) <= words
+
+        # Longer text is chosen from the pools, and has the same shape
+        rng = random.Random(1)
+        for source in (lorem_text, pooled_text):
+            self.assertEqual(source.slug(rng).count("-"), 2)
+            self.assertEqual(len(source.plaintext(rng).split("\n\n")), 3)
+            self.assertEqual(source.html(rng).count("<p>"), 3)
+        assert pooled_text.slug(rng) in pooled_text.slugs
+        assert pooled_text.plaintext(rng) in pooled_text.plaintexts
+        assert pooled_text.html(rng) in pooled_text.htmls
+
+
 class RegressionTests(TestCase):
     def setUp(self):
         self.cart = Cart.objects.create()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+      Title: Commerce framework benchmarks
+      Usage: python benchmark.py [--sizes=10,1000,20000] [--save] [--only=NAME]
+
+Description:
+    Times the hot paths of the summary engine against the sqlite test
+    settings in this directory: Summary construction, Items evaluation,
+    Total computation, FormattedDecimal formatting, json_summary(),
+    __unicode__() and as_table(), for carts of different sizes. The
+    *_money benchmarks do the same using the compact Money amounts.
+
+    For each benchmark the best wall time of a few runs, the number of SQL
+    queries and the memory allocated are reported. Allocations are measured
+    with tracemalloc where it is available, otherwise the number of new
+    objects tracked by the garbage collector is reported. Note that the
+    object count doesn't show the size of the objects, so memory saved by
+    smaller objects (eg Money's __slots__) is only seen with tracemalloc.
+
+    Results are compared to the stored baselines in benchmark_baseline.json,
+    any regression (more queries, or much slower) is reported and the exit
+    status is set. Use --save to store the current results as the baseline.
+
+"""
+import os
+import sys
+import gc
+from time import time
+from decimal import Decimal
+
+# Setup the path (could have been PYTHONPATH)
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+sys.path = [os.path.dirname(os.path.abspath(__file__)), PROJECT_ROOT] + sys.path
+
+from django.core.management import setup_environ
+import settings
+setup_environ(settings)
+
+from django.conf import settings
+from django.db import connection, reset_queries, transaction
+from django.utils import simplejson
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                    'benchmark_baseline.json')
+DEFAULT_SIZES = (10, 1000, 20000)
+# How many times each benchmark is run, the best time is reported
+REPEAT = 3
+# How much slower than the baseline a benchmark can be before it is reported
+TIME_TOLERANCE = 1.5
+
+
+#
+# Benchmarks
+#
+# Each benchmark takes a cart and does any preparation that shouldn't be
+# timed, returning a function which is timed.
+#
+
+def bench_construction(cart):
+    from basic.commerce import CartSummary
+    return lambda: CartSummary(cart)
+
+def bench_items(cart):
+    from basic.commerce import CartSummary
+    return lambda: len(CartSummary(cart).items)
+
+def bench_totals(cart):
+    from basic.commerce import CartSummary
+    def run():
+        summary = CartSummary(cart)
+        for name in summary._meta.totals:
+            getattr(summary, name)
+    return run
+
+def bench_items_money(cart):
+    from basic.commerce import CompactCartSummary
+    return lambda: len(CompactCartSummary(cart).items)
+
+def bench_sum(cart):
+    from basic.commerce import CartSummary
+    amounts = [i.AMOUNT for i in CartSummary(cart).items]
+    return lambda: sum(amounts, Decimal(0))
+
+def bench_sum_money(cart):
+    from basic.commerce import CompactCartSummary
+    amounts = [i.AMOUNT for i in CompactCartSummary(cart).items]
+    return lambda: sum(amounts)
+
+def bench_totals_money(cart):
+    from basic.commerce import CompactCartSummary
+    def run():
+        summary = CompactCartSummary(cart)
+        for name in summary._meta.totals:
+            getattr(summary, name)
+    return run
+
+def bench_formatting(cart):
+    from basic.commerce import CartSummary
+    amounts = [i.AMOUNT for i in CartSummary(cart).items]
+    return lambda: [unicode(a) for a in amounts]
+
+def bench_json_summary(cart):
+    from basic.commerce import CartSummary
+    from rollyourown.commerce import json_summary
+    fields = CartSummary._meta.elements.keys()
+    return lambda: json_summary(CartSummary(cart), fields)
+
+def bench_unicode(cart):
+    from basic.commerce import CartSummary
+    return lambda: unicode(CartSummary(cart))
+
+def bench_as_table(cart):
+    from basic.commerce import CartSummary
+    return lambda: CartSummary(cart).form().as_table()
+
+BENCHMARKS = (
+    ('construction', bench_construction),
+    ('items', bench_items),
+    ('items_money', bench_items_money),
+    ('sum', bench_sum),
+    ('sum_money', bench_sum_money),
+    ('totals', bench_totals),
+    ('totals_money', bench_totals_money),
+    ('formatting', bench_formatting),
+    ('json_summary', bench_json_summary),
+    ('unicode', bench_unicode),
+    ('as_table', bench_as_table),
+    )
+
+
+#
+# Data and measurement
+#
+
+def create_cart(size, num_products=50):
+    """ Creates a cart with the given number of lines, using executemany
+        so that large carts can be created quickly.
+    """
+    from basic.models import Cart, Product, CartItem
+    Product.objects.all().delete()
+    products = [Product.objects.create(name="Product %d" % i,
+                    price=Decimal(i * 101 % 9973) / 100)
+                    for i in range(1, num_products+1)]
+    cart = Cart.objects.create()
+    cursor = connection.cursor()
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    cursor.executemany(
+        "INSERT INTO %s (product_id, cart_id, quantity) VALUES (%%s, %%s, %%s)" % table,
+        [(products[i % num_products].pk, cart.pk, i % 7 + 1) for i in range(size)])
+    transaction.commit_unless_managed()
+    return cart
+
+def measure(run):
+    """ Returns the best time, number of queries and allocations for the
+        given function.
+    """
+    times = []
+    for i in range(REPEAT):
+        start = time()
+        run()
+        times.append(time() - start)
+
+    reset_queries()
+    run()
+    queries = len(connection.queries)
+
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        run()
+        allocations = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        gc.disable()
+        before = len(gc.get_objects())
+        run()
+        allocations = len(gc.get_objects()) - before
+        gc.enable()
+
+    return {'time': min(times), 'queries': queries, 'allocations': allocations}
+
+def compare(name, result, baseline):
+    """ Returns a list of regressions compared to the given baseline. """
+    regressions = []
+    if baseline is None:
+        return regressions
+    if result['queries'] > baseline['queries']:
+        regressions.append("%s: %d queries (baseline %d)"
+                            % (name, result['queries'], baseline['queries']))
+    if result['time'] > baseline['time'] * TIME_TOLERANCE:
+        regressions.append("%s: %.4fs (baseline %.4fs)"
+                            % (name, result['time'], baseline['time']))
+    return regressions
+
+def run_benchmarks(sizes, only=None):
+    results = {}
+    for size in sizes:
+        cart = create_cart(size)
+        for name, benchmark in BENCHMARKS:
+            if only and name not in only:
+                continue
+            key = "%s-%d" % (name, size)
+            results[key] = measure(benchmark(cart))
+            print "%-20s %10.4fs %8d queries %12d allocated" % (key,
+                results[key]['time'], results[key]['queries'],
+                results[key]['allocations'])
+    return results
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--sizes', default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma separated number of cart lines to test.")
+    parser.add_option('--only', default=None,
+                        help="Comma separated names of benchmarks to run.")
+    parser.add_option('--save', action='store_true', default=False,
+                        help="Store the results as the new baseline.")
+    options, args = parser.parse_args()
+    sizes = [int(s) for s in options.sizes.split(",")]
+    only = options.only and options.only.split(",")
+
+    # Queries are only recorded in DEBUG mode
+    settings.DEBUG = True
+    old_name = settings.DATABASE_NAME
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run_benchmarks(sizes, only)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        baselines = simplejson.load(open(BASELINE_FILE))
+
+    if options.save:
+        baselines.update(results)
+        f = open(BASELINE_FILE, 'w')
+        simplejson.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+        f.close()
+        print "Saved baseline to %s" % BASELINE_FILE
+        return 0
+
+    regressions = []
+    for key in sorted(results):
+        regressions.extend(compare(key, results[key], baselines.get(key)))
+    for regression in regressions:
+        print "REGRESSION", regression
+    return regressions and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())